@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+
+import blufi
+from blufi.constants import DATA
+from blufi.framectrl import getTypeValue
+from blufi.sim import LinkImpairment, SimulatedDevice, SimulatedLink
+import os
+import time
+
+################################################################################
+# Options
+################################################################################
+# Custom data payload posted per run
+PAYLOAD_SIZE = 4096
+
+# Encode-only rounds per combination (CPU cost of AES/CRC, no link)
+ENCODE_ROUNDS = 200
+
+# Posts per combination over the simulated link
+LINK_ROUNDS = 3
+
+# Package length, see README.md about MTU
+PACKAGE_LENGTH = 256
+
+LINK = LinkImpairment(latency=0.005, jitter=0.002, seed=1)
+
+COMBINATIONS = [
+    ('plain', False, False),
+    ('crc', False, True),
+    ('aes', True, False),
+    ('aes+crc', True, True),
+]
+
+################################################################################
+
+payload = os.urandom(PAYLOAD_SIZE)
+customType = getTypeValue(DATA.PACKAGE_VALUE, DATA.SUBTYPE_CUSTOM_DATA)
+
+# Encoding only: what each combination costs the host per KB
+client = blufi.BlufiClient()
+client.setPostPackageLengthLimit(PACKAGE_LENGTH)
+client.mAESKey = os.urandom(16)
+print('Encode %d bytes, %d rounds' % (PAYLOAD_SIZE, ENCODE_ROUNDS))
+for name, encrypt, checksum in COMBINATIONS:
+    start = time.perf_counter()
+    for _ in range(ENCODE_ROUNDS):
+        client.encodePost(encrypt, checksum, False, customType, payload)
+    elapsed = time.perf_counter() - start
+    print('  %-8s %8.1f us/KB' % (name, elapsed / ENCODE_ROUNDS / (PAYLOAD_SIZE / 1024) * 1e6))
+client.close()
+
+# End to end over a simulated link, bulk class chosen by the policy
+print('Post %d bytes over simulated link, %d rounds' % (PAYLOAD_SIZE, LINK_ROUNDS))
+for name, encrypt, checksum in COMBINATIONS:
+    with blufi.BlufiClient() as client:
+        client.setPostPackageLengthLimit(PACKAGE_LENGTH)
+        client.setSecurityPolicy(blufi.SecurityPolicy(bulkEncrypt=encrypt, bulkChecksum=checksum))
+        client.connectTransport(SimulatedLink(SimulatedDevice(echo=False), LINK))
+        client.negotiateSecurity()
+        start = time.perf_counter()
+        for _ in range(LINK_ROUNDS):
+            client.postCustomData(payload)
+        elapsed = time.perf_counter() - start
+    print('  %-8s %8.1f KB/s' % (name, PAYLOAD_SIZE * LINK_ROUNDS / 1024 / elapsed))
@@ -1,8 +1,20 @@
 
 from blufi.client import BlufiClient
+from blufi.jobs import JobStore, ProvisioningRunner
+from blufi.fragplan import FragmentPlan, FragmentPlanCache
+from blufi.fragsize import FragmentSizer
+from blufi.profile import DeviceProfile
+from blufi.policy import SecurityPolicy
+from blufi.reconnect import ReconnectPolicy
+from blufi.trace import Tracer
+from blufi.scheduler import AdapterScheduler
+from blufi.discovery import DiscoveryPipeline
+from blufi.transaction import BlufiCommand, BlufiTransaction
+from blufi.utils import LoopThread
 from blufi.exceptions import (
     BluetoothError,
     ConnectionError,
+    ProvisionError,
     RoleError,
     SecurityError,
 )
@@ -15,5 +27,6 @@ from blufi.constants import (
     STA_CONN_SUCCESS, STA_CONN_FAIL, STA_CONN_CONNECTING, STA_CONN_NO_IP,
 
     WIFI_REASON_4WAY_HANDSHAKE_TIMEOUT, WIFI_REASON_NO_AP_FOUND,
-    WIFI_REASON_HANDSHAKE_TIMEOUT, WIFI_REASON_CONNECTION_FAIL
+    WIFI_REASON_HANDSHAKE_TIMEOUT, WIFI_REASON_CONNECTION_FAIL,
+    WIFI_REASON_NAMES
 )
@@ -2,48 +2,84 @@ from typing import Optional, Callable
 
 import asyncio
 import atexit
+import concurrent.futures
+import functools
 import io
 import queue
 import struct
-import threading
 import time
 
 from bleak import BleakClient, BleakScanner
 from bleak.backends.characteristic import BleakGATTCharacteristic
 
-from blufi.exceptions import BluetoothError
+from blufi.exceptions import BluetoothError, ConnectionError, TimeoutError
 from blufi.security import BlufiAES, BlufiCRC, BlufiCrypto
 from blufi.utils import *
 from blufi.constants import *
 from blufi.framectrl import *
+from blufi.fragplan import FragmentPlan, FragmentPlanCache, defaultPlanCache
+from blufi.fragsize import FragmentSizer
+from blufi.policy import SecurityPolicy, classify, MSG_CREDENTIAL
+from blufi.profile import DeviceProfile
+from blufi.reconnect import ReconnectPolicy
+from blufi.trace import NULL_SPAN, Tracer
+from blufi.transaction import BlufiTransaction
 
 import logging
 log = logging.getLogger("blufi")
 logging.basicConfig(level=logging.ERROR)
 logging.getLogger("blufi").setLevel(logging.DEBUG)
 
+# Seconds to wait for the device to ack a frame posted with requireAck.
+ACK_TIMEOUT = 5.0
+# Default overall deadlines, in seconds, for the high-level operations.
+DEFAULT_CONNECT_TIMEOUT = 20.0
+DEFAULT_OP_TIMEOUT = 10.0
+DEFAULT_SCAN_TIMEOUT = 10.0
+# Extra time await_bleak gives a deadline-aware coroutine to fail on its own
+# before cancelling it.
+DEADLINE_GRACE = 0.5
+# waitForStaConnection status polling, only used when the device does not
+# push a state frame by itself. Interval doubles from MIN up to MAX.
+STA_POLL_INTERVAL_MIN = 0.5
+STA_POLL_INTERVAL_MAX = 4.0
+
 class BlufiClient:
-    def __init__(self):
-        # Created on demand in self._bleak_thread context.
+    def __init__(self, adapter: Optional[str] = None, loop: Optional[LoopThread] = None):
+        """`loop` is a LoopThread to share with other clients. Without one the
+        client runs its own, stopped by close()."""
+        # Local BLE controller to use (e.g. "hci1"). None means bleak's default.
+        self.adapter = adapter
+        # Created on demand in the bleak loop thread.
         self._scanner = None
         self._bleak_client = None
-        self._bleak_loop = None
-        self._bleak_thread = threading.Thread(target=self._run_bleak_loop)
-        # Discard thread quietly on exit.
-        self._bleak_thread.daemon = True
-        self._bleak_thread_ready = threading.Event()
-        self._bleak_thread.start()
-        # Wait for thread to start.
-        self._bleak_thread_ready.wait()
+        # Set when connected through connectTransport
+        self._transport = None
+        self._ownsLoop = loop is None
+        self._loopThread = LoopThread() if loop is None else loop
+        self._bleak_loop = self._loopThread.loop
+        self._closed = False
+        # concurrent.Futures of operations running in the bleak loop
+        self._inflight = set()
+        # Optional Tracer, see setTracer
+        self.tracer = None
         # Sync
         self.secEvent = Event_ts(self._bleak_loop)
         self.ssidListEvent = Event_ts(self._bleak_loop)
+        # Set while the link is down after having been up
+        self.linkLostEvent = Event_ts(self._bleak_loop)
+        # Reconnect
+        self.reconnectPolicy = None
+        self._reconnectTask = None
+        self._userDisconnect = False
         # Security
         self.crypto = None
         self.mAESKey = None
         self.mEncrypted = False
         self.mChecksum = False
         self.mRequireAck = False
+        # Encryption and checksum per message class once negotiated
+        self.securityPolicy = SecurityPolicy()
         # Services
         self.dev = None
         self.svc = None
@@ -53,6 +89,10 @@ class BlufiClient:
         # Settings
         self.mPackageLengthLimit = -1
         self.mBlufiMTU = -1
+        # Optional FragmentSizer, see setFragmentSizer
+        self.fragSizer = None
+        # Fragmentation plans shared with other clients, see setFragmentPlanCache
+        self.fragmentPlans = defaultPlanCache
         # State data
         self._reset_state()
         self.ssidList = []
@@ -64,9 +104,16 @@ class BlufiClient:
         atexit.register(self._cleanup)
 
     def _reset_state(self) -> None:
+        # send sequence -> asyncio.Future resolved by parseAck
+        for fut in getattr(self, '_ackFutures', {}).values():
+            if not fut.done():
+                fut.cancel()
+        self._ackFutures = {}
         self.connected = False
         self._notify_en = False
         self.mSendSequence = -1
+        # Sequence of the last frame handed to write_gatt_char
+        self._lastSentSequence = -1
         self.mReadSequence = -1
         self.mEncrypted = False
         self.mChecksum = False
@@ -76,8 +123,21 @@ class BlufiClient:
         self.wifiState = {
             "opMode": -1,
             "staConn": -1,
-            "softAPConn": -1
+            "softAPConn": -1,
+            "reason": -1,
+            "rssi": None,
         }
+        # Outcome of the last CTRL.SUBTYPE_CONNECT_WIFI, None while pending
+        self.staConnResult = None
+        for fut in getattr(self, '_staConnWaiters', []):
+            if not fut.done():
+                fut.cancel()
+        self._staConnWaiters = []
+        # Shared key derivation running in the executor, see parsePublicKey
+        fut = getattr(self, '_sharedKeyFuture', None)
+        if fut is not None and not fut.done():
+            fut.cancel()
+        self._sharedKeyFuture = None
 
     def _cleanup(self) -> None:
         """Clean up connections, so that the underlying OS software does not
@@ -85,7 +145,7 @@ class BlufiClient:
         """
         self._reset_state()
         if self._bleak_client:
-            self.await_bleak(self._disconnect_async())
+            self.await_bleak(self._disconnect_async(), DEFAULT_OP_TIMEOUT)
 
     def setPostPackageLengthLimit(self, lengthLimit):
         """Arbirarily lower send package size. NOTE: MTU for esp32 BLE nimble
@@ -98,21 +158,187 @@ class BlufiClient:
             # subtract 4: 3 for BLE header, 1 reserved (Blufi, unused)
             self.mPackageLengthLimit = max(lengthLimit-4, MIN_PACKAGE_LENGTH)
 
+    def setFragmentSizer(self, sizer: Optional[FragmentSizer]) -> None:
+        """Adapt the package length to the link: `sizer` grows it while
+        writes go through quickly and shrinks it on missing acks, failed writes
+        and CRC errors. A limit set with setPostPackageLengthLimit (or the
+        MTU) still caps it. None goes back to the fixed length."""
+        self.fragSizer = sizer
+        if sizer is not None and self.connected and self.dev is not None:
+            sizer.attach(self.dev.address)
+
+    def setFragmentPlanCache(self, cache: Optional[FragmentPlanCache]) -> None:
+        """Where fragmented payloads keep their fragmentation plans. All
+        clients share blufi.fragplan.defaultPlanCache unless given another
+        one; None cuts every payload up afresh. Credentials and key exchange
+        frames are never cached."""
+        self.fragmentPlans = cache
+
+    @staticmethod
+    def _cachePlan(type: int) -> bool:
+        """Credentials must not outlive their post in a shared cache, and a
+        DH public key is never sent twice."""
+        return classify(type) != MSG_CREDENTIAL and type != getTypeValue(DATA.PACKAGE_VALUE, DATA.SUBTYPE_NEG)
+
+    def _packageLengthLimit(self) -> int:
+        pkgLengthLimit = self.mPackageLengthLimit if self.mPackageLengthLimit > 0 else (self.mBlufiMTU if self.mBlufiMTU > 0 else DEFAULT_PACKAGE_LENGTH)
+        if self.fragSizer is not None:
+            size = self.fragSizer.packageLength()
+            if self.mPackageLengthLimit > 0 or self.mBlufiMTU > 0:
+                size = min(size, pkgLengthLimit)
+            pkgLengthLimit = size
+        return min(pkgLengthLimit, MAX_PACKAGE_LENGTH)
+
+    def setSecurityPolicy(self, policy: SecurityPolicy) -> None:
+        """Choose encryption and checksum per message class. Applies to
+        frames sent after negotiateSecurity; the device's own frames follow
+        the policy given at negotiation time."""
+        self.securityPolicy = policy
+
+    def _frameSecurity(self, type: int, encrypt: Optional[bool], checksum: Optional[bool]):
+        """Resolve (encrypt, checksum) for a frame. None picks what the
+        security policy says once security is negotiated, off before that.
+        Credentials are encrypted whenever there is a key, whatever the
+        caller asked for."""
+        secured = self.mEncrypted and self.mAESKey is not None
+        if secured and type != getTypeValue(DATA.PACKAGE_VALUE, DATA.SUBTYPE_NEG):
+            policyEncrypt, policyChecksum = self.securityPolicy.choose(type)
+            if classify(type) == MSG_CREDENTIAL:
+                encrypt = True
+        else:
+            policyEncrypt, policyChecksum = False, False
+        return (policyEncrypt if encrypt is None else encrypt,
+                policyChecksum if checksum is None else checksum)
+
+    def setReconnectPolicy(self, policy: Optional[ReconnectPolicy]) -> None:
+        """Reconnect automatically, as described by `policy`, when the link
+        drops. None (the default) turns it off: operations in progress then
+        fail with ConnectionError."""
+        self.reconnectPolicy = policy
+
+    def setTracer(self, tracer: Optional[Tracer]) -> None:
+        """Record a timeline of writes, notifications, crypto work and
+        thread hops into `tracer`. None turns tracing off."""
+        self.tracer = tracer
+
+    def _span(self, name: str, **args):
+        if self.tracer is None:
+            return NULL_SPAN
+        return self.tracer.span(name, **args)
+
+    async def _traced_hop(self, coro, submitted: int):
+        # Time from run_coroutine_threadsafe until the loop picks the work up
+        self.tracer.complete("thread hop", submitted)
+        with self._span(getattr(coro, '__qualname__', 'coroutine')):
+            return await coro
+
     async def _disconnect_async(self) -> None:
         """Disconnects from the remote peripheral. Does nothing if already disconnected."""
+        self._userDisconnect = True
+        if self._reconnectTask is not None:
+            self._reconnectTask.cancel()
         await self._bleak_client.disconnect()
 
-    def _run_bleak_loop(self) -> None:
-        self._bleak_loop = asyncio.new_event_loop()
-        # Event loop is now available.
-        self._bleak_thread_ready.set()
-        self._bleak_loop.run_forever()
+    async def _close_async(self) -> None:
+        if self._reconnectTask is not None:
+            self._reconnectTask.cancel()
+        if self._bleak_client is not None:
+            self._userDisconnect = True
+            if self._notify_en and self.connected:
+                try:
+                    await self._bleak_client.stop_notify(BLUFI_NOTIF_CHAR_UUID)
+                except Exception as e:
+                    log.debug("close: stop_notify failed: %s" % e)
+            await self._disconnect_async()
+        self._reset_state()
+        self._bleak_client = None
+        self._transport = None
+        self.dev = None
+
+    def close(self) -> None:
+        """Disconnect, stop notifications and stop the client's loop thread
+        (unless it is shared). The client can't be used afterwards. Calling
+        it again does nothing."""
+        if self._closed:
+            return
+        atexit.unregister(self._cleanup)
+        self.cancel()
+        try:
+            if self._loopThread.is_alive():
+                self.await_bleak(self._close_async(), DEFAULT_OP_TIMEOUT)
+        except Exception as e:
+            log.warning("close: %s" % e)
+        finally:
+            self._closed = True
+            if self._ownsLoop:
+                self._loopThread.stop()
+
+    async def aclose(self) -> None:
+        """close() for async code. Works from the client's own loop too."""
+        if asyncio.get_running_loop() is not self._bleak_loop:
+            await asyncio.get_running_loop().run_in_executor(None, self.close)
+            return
+        if self._closed:
+            return
+        atexit.unregister(self._cleanup)
+        try:
+            await self._close_async()
+        finally:
+            self._closed = True
+            if self._ownsLoop:
+                self._loopThread.stop()
+
+    def __enter__(self) -> 'BlufiClient':
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    async def __aenter__(self) -> 'BlufiClient':
+        return self
+
+    async def __aexit__(self, *exc) -> None:
+        await self.aclose()
 
     def await_bleak(self, coro, timeout: Optional[float] = None):
-        """Call an async routine in the bleak thread from sync code, and await its result."""
+        """Call an async routine in the bleak thread from sync code, and await its result.
+        If it does not finish within `timeout` seconds it is cancelled and
+        TimeoutError is raised.
+        """
+        if self._closed:
+            coro.close()
+            raise BluetoothError("Client is closed")
+        name = getattr(coro, '__qualname__', 'coroutine')
+        if self.tracer is not None:
+            coro = self._traced_hop(coro, time.perf_counter_ns())
         # This is a concurrent.Future.
         future = asyncio.run_coroutine_threadsafe(coro, self._bleak_loop)
-        return future.result(timeout)
+        self._inflight.add(future)
+        try:
+            with self._span("await_bleak", op=name):
+                return future.result(timeout)
+        except concurrent.futures.TimeoutError:
+            if future.done():
+                # Raised by the coroutine itself (it is the builtin
+                # TimeoutError since 3.11), not our wait running out.
+                raise
+            # Cancels the task in the bleak loop as well, its cleanup runs
+            # before anything submitted after this returns.
+            future.cancel()
+            raise TimeoutError("operation timed out after %.1fs" % timeout) from None
+        finally:
+            self._inflight.discard(future)
+
+    def _await_deadline(self, coro, deadline: Deadline):
+        timeout = deadline.remaining()
+        return self.await_bleak(coro, None if timeout is None else timeout + DEADLINE_GRACE)
+
+    def cancel(self) -> None:
+        """Cancel every operation of this client currently running in the
+        bleak loop. Safe to call from any thread; the callers blocked on them
+        get concurrent.futures.CancelledError."""
+        for future in list(self._inflight):
+            future.cancel()
 
     async def _wait(self, timeout: float) -> None:
         await asyncio.sleep(timeout)
@@ -123,7 +349,8 @@ class BlufiClient:
     def onNotify(self, characteristic: BleakGATTCharacteristic, data: bytearray):
         """Simple notification handler which prints the data received."""
         # print("%s: %r" % (characteristic.description, data))
-        self.parseNotification(data)
+        with self._span("notify", len=len(data)):
+            self.parseNotification(data)
 
     # def connectByAddr(self, addr: str, timeout: float) -> None:
     #     return self.await_bleak(self._connect_async(address, timeout=timeout))
@@ -135,7 +362,7 @@ class BlufiClient:
         if not self._notify_en:
             log.warning("stopNotify: already disabled")
             return
-        self.await_bleak(self._bleak_client.stop_notify(BLUFI_NOTIF_CHAR_UUID))
+        self.await_bleak(self._bleak_client.stop_notify(BLUFI_NOTIF_CHAR_UUID), DEFAULT_OP_TIMEOUT)
         self._notify_en = False
 
     def startNotify(self):
@@ -145,25 +372,51 @@ class BlufiClient:
         if self._notify_en:
             log.warning("stopNotify: already enabled")
             return
-        self.await_bleak(self._bleak_client.start_notify(BLUFI_NOTIF_CHAR_UUID, self.onNotify))
+        self.await_bleak(self._bleak_client.start_notify(BLUFI_NOTIF_CHAR_UUID, self.onNotify), DEFAULT_OP_TIMEOUT)
         self._notify_en = True
 
-    def connectByName(self, name: str, timeout: float = None) -> None:
-        return self.await_bleak(self._connect_async_name(name, timeout=timeout))
+    def connectByName(self, name: str, timeout: Optional[float] = DEFAULT_CONNECT_TIMEOUT) -> bool:
+        """Scan for `name` and connect. `timeout` covers scan, connect and
+        enabling notifications together."""
+        deadline = Deadline(timeout)
+        return self._await_deadline(self._connect_async_name(name, deadline), deadline)
+
+    def connectByDevice(self, device, timeout: Optional[float] = DEFAULT_CONNECT_TIMEOUT) -> bool:
+        """Connect to a BLEDevice found by an earlier scan, e.g. handed out by
+        DiscoveryPipeline, without scanning again."""
+        deadline = Deadline(timeout)
+        return self._await_deadline(self._connect_async_found(device, deadline), deadline)
 
-    async def _connect_async_name(self, name: str, timeout: float) -> bool:
+    async def _connect_async_found(self, device, deadline: Deadline) -> bool:
+        self._reset_state()
+        return await self._connect_async_device(device, deadline)
+
+    def _adapter_kwargs(self) -> dict:
+        # Only pass adapter through when set, backends other than BlueZ do not
+        # know about it.
+        return dict(adapter=self.adapter) if self.adapter else {}
+
+    async def _connect_async_name(self, name: str, deadline: Deadline) -> bool:
         self._reset_state()
         # Use cached device if possible, to avoid having BleakClient do
-        # a scan again.
+        # a scan again. Leave at least half of the budget for connecting.
         device = await BleakScanner.find_device_by_name(
-            name, cb=dict(use_bdaddr=False)
+            name, timeout=deadline.budget(0.5, DEFAULT_SCAN_TIMEOUT),
+            cb=dict(use_bdaddr=False), **self._adapter_kwargs()
         )
+        if device is None:
+            log.error("connectByName: %s not found" % name)
+            return False
+        return await self._connect_async_device(device, deadline)
 
-        client = BleakClient(device)
+    async def _connect_async_device(self, device, deadline: Deadline) -> bool:
+        self.dev = device
+        client = BleakClient(device, disconnected_callback=self._onDisconnect, **self._adapter_kwargs())
         # connect() takes a timeout, but it's a timeout to do a
         # discover() scan, not an actual connect timeout.
         try:
-            await client.connect(timeout=timeout)
+            remaining = deadline.remaining()
+            await client.connect(timeout=DEFAULT_SCAN_TIMEOUT if remaining is None else remaining)
             if get_platform_type() != 'Linux':
                 log.info("MTU: %d" % client.mtu_size)
                 self.mBlufiMTU = client.mtu_size - 4
@@ -172,16 +425,127 @@ class BlufiClient:
             svc = client.services.get_service(BLUFI_SERVICE_UUID)
             self.notif_char = svc.get_characteristic(BLUFI_NOTIF_CHAR_UUID)
             self.write_char = svc.get_characteristic(BLUFI_WRITE_CHAR_UUID)
-            await client.start_notify(BLUFI_NOTIF_CHAR_UUID, self.onNotify)
+            await asyncio.wait_for(client.start_notify(BLUFI_NOTIF_CHAR_UUID, self.onNotify), deadline.remaining())
             self._notify_en = True
         except asyncio.TimeoutError:
             # raise BluetoothError("Failed to connect: timeout") from asyncio.TimeoutError
+            await client.disconnect()
             return False
+        except asyncio.CancelledError:
+            # Don't leave a half set up connection behind.
+            await client.disconnect()
+            raise
 
+        self._transport = None
+        self._onConnected(client, device.address)
+        return True
+
+    def _onConnected(self, client, address: str) -> None:
         self.connected = True
+        self._userDisconnect = False
+        if self.fragSizer is not None:
+            self.fragSizer.attach(address)
+        self.linkLostEvent.clear()
         self._bleak_client = client
+
+    def connectTransport(self, transport, timeout: Optional[float] = DEFAULT_CONNECT_TIMEOUT) -> bool:
+        """Talk over `transport` instead of a BLE device found by scanning.
+        `transport` provides the parts of BleakClient used here
+        (write_gatt_char, start_notify, stop_notify, disconnect, is_connected,
+        address), e.g. blufi.sim.SimulatedLink."""
+        deadline = Deadline(timeout)
+        return self._await_deadline(self._connect_async_transport(transport, deadline), deadline)
+
+    async def _connect_async_transport(self, transport, deadline: Deadline) -> bool:
+        self._reset_state()
+        self.dev = transport
+        self._transport = transport
+        if not transport.is_connected:
+            await asyncio.wait_for(transport.connect(), deadline.remaining())
+        if hasattr(transport, 'setDisconnectedCallback'):
+            transport.setDisconnectedCallback(self._onDisconnect)
+        await asyncio.wait_for(transport.start_notify(BLUFI_NOTIF_CHAR_UUID, self.onNotify), deadline.remaining())
+        self._notify_en = True
+        self._onConnected(transport, transport.address)
         return True
 
+    def _onDisconnect(self, client: BleakClient) -> None:
+        """bleak disconnected_callback, runs in the bleak loop."""
+        if client is not self._bleak_client or not self.connected:
+            return
+        log.warning("disconnected from %s" % client.address)
+        self.connected = False
+        self._notify_en = False
+        self.linkLostEvent.set()
+        # Fail whoever is waiting on the device right away instead of letting
+        # them run into their timeouts.
+        err = ConnectionError("Disconnected")
+        waiters = list(self._ackFutures.values()) + self._staConnWaiters
+        self._ackFutures = {}
+        self._staConnWaiters = []
+        for fut in waiters:
+            if not fut.done():
+                fut.set_exception(err)
+        if self.reconnectPolicy is not None and not self._userDisconnect:
+            self._startReconnect()
+
+    def _startReconnect(self) -> asyncio.Task:
+        if self._reconnectTask is None or self._reconnectTask.done():
+            self._reconnectTask = self._bleak_loop.create_task(self._reconnect_async())
+        return self._reconnectTask
+
+    async def _reconnect_async(self) -> None:
+        policy = self.reconnectPolicy
+        wasSecure = self.mAESKey is not None
+        for attempt, delay in enumerate(policy.delays(), 1):
+            await asyncio.sleep(delay)
+            log.info("reconnect attempt %d to %s" % (attempt, self.dev))
+            self._reset_state()
+            try:
+                if self._transport is not None:
+                    connected = await self._connect_async_transport(self._transport, Deadline(policy.connectTimeout))
+                else:
+                    connected = await self._connect_async_device(self.dev, Deadline(policy.connectTimeout))
+                if not connected:
+                    continue
+                if wasSecure and policy.renegotiate:
+                    # Key generation is too slow to run on the loop.
+                    self.crypto = await self._bleak_loop.run_in_executor(None, self._newCrypto)
+                    if not await self._negotiate_security_async(Deadline(policy.connectTimeout)):
+                        await self._bleak_client.disconnect()
+                        continue
+            except Exception as e:
+                log.error("reconnect failed: %s" % e)
+                continue
+            log.info("reconnected after %d attempt(s)" % attempt)
+            return
+        raise ConnectionError("Reconnect failed after %d attempts" % policy.maxAttempts)
+
+    async def _await_reconnect(self, err: Exception) -> None:
+        """Called by an operation that lost the link. Re-raises `err` unless a
+        reconnect policy is set and the reconnect succeeds."""
+        if self.reconnectPolicy is None or self._userDisconnect:
+            raise err
+        if asyncio.current_task() is self._reconnectTask:
+            # Lost the link again while renegotiating
+            raise err
+        await asyncio.shield(self._startReconnect())
+
+    async def _wait_event(self, evt: asyncio.Event, timeout: Optional[float]) -> bool:
+        """event_wait that gives up as soon as the link drops."""
+        waiter = asyncio.ensure_future(evt.wait())
+        lost = asyncio.ensure_future(self.linkLostEvent.wait())
+        try:
+            await asyncio.wait({waiter, lost}, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            waiter.cancel()
+            lost.cancel()
+        if evt.is_set():
+            return True
+        if self.linkLostEvent.is_set():
+            raise ConnectionError("Disconnected")
+        return False
+
     def generateSendSequence(self):
         self.mSendSequence += 1
         self.mSendSequence = self.mSendSequence & 0xFF
@@ -199,11 +563,35 @@ class BlufiClient:
 
     def parsePublicKey(self, data):
         log.debug("parsePublicKey %d bytes" % len(data))
+        if self.crypto is None:
+            log.error("parsePublicKey: not negotiating")
+            return
         self.rxPubKeyBuf.extend(data)
-        self.mAESKey = self.crypto.deriveSharedKey(self.rxPubKeyBuf)
-        # This method is called from the bt notify callback and thus outside of
-        # the event loop. Set an async event that gets checked in the main
-        # thread, which will then call postSetSecurity
+        keyLength = len(self.crypto.getPBytes())
+        if len(self.rxPubKeyBuf) < keyLength:
+            return
+        peerKey = bytes(self.rxPubKeyBuf[:keyLength])
+        self.rxPubKeyBuf = bytearray()
+        # The modular exponentiation takes milliseconds. This runs in the
+        # notify callback, so hand it to the executor rather than stall every
+        # client on the loop.
+        self._sharedKeyFuture = self._bleak_loop.run_in_executor(None, self.crypto.deriveSharedKey, peerKey)
+        self._sharedKeyFuture.add_done_callback(
+            functools.partial(self._onSharedKey, self.crypto, time.perf_counter_ns()))
+
+    def _onSharedKey(self, crypto: BlufiCrypto, started: int, future: asyncio.Future) -> None:
+        """Done callback of the shared key derivation, runs in the bleak loop."""
+        if future.cancelled() or crypto is not self.crypto:
+            # Reset or renegotiated meanwhile
+            return
+        if self.tracer is not None:
+            self.tracer.complete("derive shared key", started)
+        try:
+            self.mAESKey = future.result()
+        except Exception as e:
+            log.error("deriveSharedKey failed: %s" % e)
+            return
+        # _negotiate_security_async waits for this, then calls postSetSecurity
         self.secEvent.set()
 
     def parseVersion(self, data):
@@ -230,6 +618,54 @@ class BlufiClient:
         log.debug("softAPConn = 0x%02X" % softAPConn)
         self.wifiState["softAPConn"] = softAPConn
 
+        # Optional type-length-value fields follow, type being a DATA subtype
+        while True:
+            hdr = dataIS.read(2)
+            if len(hdr) < 2:
+                break
+            fieldType, fieldLen = hdr[0], hdr[1]
+            value = dataIS.read(fieldLen)
+            if len(value) != fieldLen:
+                log.error("wifi state: truncated field 0x%02X" % fieldType)
+                break
+            if fieldType == DATA.SUBTYPE_STA_WIFI_BSSID:
+                self.wifiState["bssid"] = value.hex(':')
+            elif fieldType == DATA.SUBTYPE_STA_WIFI_SSID:
+                self.wifiState["ssid"] = value.decode(errors='replace')
+            elif fieldType == DATA.SUBTYPE_WIFI_STA_CONN_END_REASON and fieldLen > 0:
+                self.parseStaConnEndReason(value)
+            elif fieldType == DATA.SUBTYPE_WIFI_STA_CONN_RSSI and fieldLen > 0:
+                self.parseStaConnRssi(value)
+            elif fieldType == DATA.SUBTYPE_WIFI_STA_MAX_CONN_RETRY and fieldLen > 0:
+                self.wifiState["maxConnRetry"] = value[0]
+
+        if staConn in (STA_CONN_SUCCESS, STA_CONN_FAIL):
+            self.onStaConnResult(staConn)
+
+    def parseStaConnEndReason(self, data):
+        self.wifiState["reason"] = data[0] & 0xff
+        log.debug("sta conn end reason = %d" % self.wifiState["reason"])
+
+    def parseStaConnRssi(self, data):
+        self.wifiState["rssi"] = struct.unpack('<b', bytes(data[:1]))[0]
+        log.debug("sta conn rssi = %d" % self.wifiState["rssi"])
+
+    def onStaConnResult(self, staConn):
+        reason = self.wifiState["reason"]
+        success = staConn == STA_CONN_SUCCESS
+        self.staConnResult = {
+            "success": success,
+            "staConn": staConn,
+            "reason": -1 if success else reason,
+            "reasonName": None if success else WIFI_REASON_NAMES.get(reason),
+            "rssi": self.wifiState["rssi"],
+        }
+        log.info("sta connection %s" % ("success" if success else "failed, reason %d" % reason))
+        waiters, self._staConnWaiters = self._staConnWaiters, []
+        for fut in waiters:
+            if not fut.done():
+                fut.set_result(self.staConnResult)
+
     def getWifiState(self):
         return self.wifiState
 
@@ -274,8 +710,36 @@ class BlufiClient:
         if len(data) > 0:
             ack = data[0] & 0xff
             log.debug('gotack = 0x%02X' % ack)
-        # self.mAck.put(ack)
-        # TODO: handle ack checking
+        fut = self._ackFutures.pop(ack, None)
+        if fut is not None and not fut.done():
+            fut.set_result(True)
+
+    def _expectAck(self, sequence: int) -> asyncio.Future:
+        """Register interest in the ack for `sequence`. Must be called before
+        the frame is written, the ack can arrive before the write returns."""
+        fut = self._bleak_loop.create_future()
+        self._ackFutures[sequence] = fut
+        return fut
+
+    async def receiveAck(self, sequence: int, timeout: float = ACK_TIMEOUT,
+                         future: Optional[asyncio.Future] = None) -> bool:
+        """Wait for the ack of `sequence`. Pass the future returned by
+        _expectAck: parseAck hands the ack to it and forgets the sequence, so
+        an ack that came in during the write is only found there."""
+        fut = future if future is not None else self._ackFutures.get(sequence)
+        if fut is None:
+            fut = self._expectAck(sequence)
+        try:
+            await asyncio.wait_for(asyncio.shield(fut), timeout)
+            return True
+        except asyncio.TimeoutError:
+            log.error("no ack for seq %d" % sequence)
+            if self.fragSizer is not None:
+                self.fragSizer.onError("ack timeout")
+            return False
+        finally:
+            if self._ackFutures.get(sequence) is fut:
+                del self._ackFutures[sequence]
 
     def parseCtrlData(self, subType, data):
         log.debug("parseCtrlData: 0x%02X" % subType)
@@ -301,6 +765,10 @@ class BlufiClient:
             self.onError(errCode)
         elif subType == DATA.SUBTYPE_CUSTOM_DATA:
             self.onCustomData(data)
+        elif subType == DATA.SUBTYPE_WIFI_STA_CONN_END_REASON and len(data) > 0:
+            self.parseStaConnEndReason(data)
+        elif subType == DATA.SUBTYPE_WIFI_STA_CONN_RSSI and len(data) > 0:
+            self.parseStaConnRssi(data)
         else:
             log.error('parseDataData: Unknown subtype')
 
@@ -322,8 +790,9 @@ class BlufiClient:
         dataBytes = bytearray(data[4:4+dataLen])
 
         if fctl.isEncrypted():
-            aes = BlufiAES(self.mAESKey, generateAESIV(seq))
-            dataBytes = aes.decrypt(dataBytes)
+            with self._span("aes decrypt", len=dataLen):
+                aes = BlufiAES(self.mAESKey, generateAESIV(seq))
+                dataBytes = aes.decrypt(dataBytes)
 
         if fctl.isChecksum():
             log.info('got checksum')
@@ -331,13 +800,16 @@ class BlufiClient:
             respChecksum2 = int(data[len(data) - 2])
 
             nonDataBytes = struct.pack("<BB", seq, dataLen)
-            crc = BlufiCRC.calcCRC(0, nonDataBytes)
-            crc = BlufiCRC.calcCRC(crc, dataBytes)
+            with self._span("crc", len=dataLen):
+                crc = BlufiCRC.calcCRC(0, nonDataBytes)
+                crc = BlufiCRC.calcCRC(crc, dataBytes)
             calcChecksum1 = crc >> 8 & 0xff
             calcChecksum2 = crc & 0xff
 
             if (respChecksum1 != calcChecksum1) or (respChecksum2 != calcChecksum2):
                 log.error("parseNotification: read invalid checksum")
+                if self.fragSizer is not None:
+                    self.fragSizer.onError("crc")
                 log.debug("expect checksum: ", respChecksum1, ", ", respChecksum2)
                 log.debug("received checksum: ", calcChecksum1, ", ", calcChecksum2)
                 return
@@ -366,108 +838,149 @@ class BlufiClient:
             self.rxBuf = bytearray()
 
     def getPostBytes(self, type: int, encrypt: bool, checksum: bool, requireAck: bool, hasFrag: bool, sequence: int, data: bytes) -> bytes:
-        byteOS = io.BytesIO()
-
         dataLength = len(data) if data else 0
         frameCtrl = FrameCtrlData.getFrameCTRLValue(encrypt, checksum, DIRECTION_OUTPUT, requireAck, hasFrag)
-
-        byteOS.write(bytes([type]))
-        byteOS.write(bytes([frameCtrl]))
-        byteOS.write(bytes([sequence]))
-        byteOS.write(bytes([dataLength]))
+        parts = [bytes([type, frameCtrl, sequence, dataLength])]
 
         if checksum:
             willCheckBytes = struct.pack("<BB", sequence, dataLength)
-            crc = BlufiCRC.calcCRC(0, willCheckBytes)
-            if dataLength > 0:
-                crc = BlufiCRC.calcCRC(crc, data)
+            with self._span("crc", len=dataLength):
+                crc = BlufiCRC.calcCRC(0, willCheckBytes)
+                if dataLength > 0:
+                    crc = BlufiCRC.calcCRC(crc, data)
             checksumBytes = struct.pack("<H", crc)
         else:
             checksumBytes = None
 
         if encrypt and dataLength > 0:
-            aes = BlufiAES(self.mAESKey, generateAESIV(sequence))
-            data = aes.encrypt(data)
+            with self._span("aes encrypt", len=dataLength):
+                aes = BlufiAES(self.mAESKey, generateAESIV(sequence))
+                data = aes.encrypt(data)
 
         if data:
-            byteOS.write(data)
+            parts.append(data)
 
         if checksumBytes:
-            byteOS.write(checksumBytes)
+            parts.append(checksumBytes)
 
-        return byteOS.getvalue()
+        return b"".join(parts)
 
-    async def postNonData(self, encrypt: bool, checksum: bool, requireAck: bool, type: int) -> bool:
-        sequence = self.generateSendSequence()
-        postBytes = self.getPostBytes(type, encrypt, checksum, requireAck, False, sequence, None)
-        await self._bleak_client.write_gatt_char(self.write_char, postBytes, True)
-        # return posted and (not requireAck or receiveAck(sequence))
-        return True
+    def encodePost(self, encrypt: bool, checksum: bool, requireAck: bool, type: int, data: Optional[bytes]) -> list:
+        """Encode a post into wire frames, fragmenting as needed. Assigns send
+        sequences, so frames must be written in the returned order.
+        Returns a list of (sequence, hasFrag, postBytes, end), `end` being the
+        offset in `data` just past the frame's content.
+        """
+        if type == getTypeValue(CTRL.PACKAGE_VALUE, CTRL.SUBTYPE_CONNECT_WIFI):
+            # A new attempt, forget the outcome of the previous one.
+            self.staConnResult = None
+            self.wifiState["reason"] = -1
+            self.wifiState["rssi"] = None
+        if not data:
+            sequence = self.generateSendSequence()
+            return [(sequence, False, self.getPostBytes(type, encrypt, checksum, requireAck, False, sequence, None), 0)]
 
-    async def postContainData(self, encrypt: bool, checksum: bool, requireAck: bool, type: int, data: bytearray) -> bool:
-        dataIS = io.BytesIO(data)
-        readLeft = len(data)
-        dataContent = io.BytesIO()
-        pkgLengthLimit = self.mPackageLengthLimit if self.mPackageLengthLimit > 0 else (self.mBlufiMTU if self.mBlufiMTU > 0 else DEFAULT_PACKAGE_LENGTH)
+        pkgLengthLimit = self._packageLengthLimit()
         postDataLengthLimit = pkgLengthLimit - PACKAGE_HEADER_LENGTH
         postDataLengthLimit -= 2  # if frag, two bytes total length in data
         if checksum:
             postDataLengthLimit -= 2
-        dataBuf = bytearray(postDataLengthLimit)
-        # print('postDataLengthLimit ', postDataLengthLimit)
-        while True:
-            read = dataIS.readinto(dataBuf)
-            if not read:
-                # print('break')
-                break
-            readLeft -= read
-            # print('read = ', read)
-            # print('read = ', dataIS.readall())
-            dataContent.write(dataBuf[:read])
-            # print("dataIS.readable() = ", dataIS.readable())
-            if readLeft > 0 and readLeft <= 2:
-                read = dataIS.readinto(dataBuf)
-                dataContent.write(dataBuf[:read])
-                readLeft -= read
-            frag = readLeft > 0
+
+        if len(data) <= postDataLengthLimit + 2:
+            # Fits one frame (see FragmentPlan), nothing to plan
             sequence = self.generateSendSequence()
-            if frag:
-                totalLen = dataContent.tell() + readLeft
-                tempData = dataContent.getvalue()
-                dataContent.seek(0)
-                dataContent.write(struct.pack("<H", totalLen))
-                dataContent.write(tempData)
-                # print('totalLen =', totalLen)
-                # print('tempData = ', dataContent.getvalue())
-            postBytes = self.getPostBytes(type, encrypt, checksum, requireAck, frag, sequence, dataContent.getvalue())
-            dataContent.seek(0)
-            dataContent.truncate()
+            return [(sequence, False, self.getPostBytes(type, encrypt, checksum, requireAck, False, sequence, bytes(data)), len(data))]
+        if self.fragmentPlans is not None and self._cachePlan(type):
+            plan = self.fragmentPlans.get(data, postDataLengthLimit)
+        else:
+            plan = FragmentPlan(data, postDataLengthLimit)
+
+        frames = []
+        for chunk, frag, end in plan.fragments:
+            sequence = self.generateSendSequence()
+            frames.append((sequence, frag, self.getPostBytes(type, encrypt, checksum, requireAck, frag, sequence, chunk), end))
+        return frames
+
+    async def _write(self, sequence: int, postBytes: bytes) -> None:
+        if self.linkLostEvent.is_set():
+            raise ConnectionError("Disconnected")
+        # Once handed to bleak the frame counts as sent, even if the write is
+        # then cancelled: the device may well have received it.
+        prevSequence = self._lastSentSequence
+        self._lastSentSequence = sequence
+        started = time.monotonic()
+        try:
+            with self._span("write_gatt_char", seq=sequence, len=len(postBytes)):
+                await self._bleak_client.write_gatt_char(self.write_char, postBytes, True)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self._lastSentSequence = prevSequence
+            if self.fragSizer is not None:
+                self.fragSizer.onError("write failed")
+            if self.linkLostEvent.is_set() or not getattr(self._bleak_client, 'is_connected', True):
+                raise ConnectionError("Disconnected") from e
+            raise
+        if self.fragSizer is not None:
+            self.fragSizer.onWrite(time.monotonic() - started)
+
+    def _rewindSendSequence(self) -> None:
+        """Frames are numbered when encoded. When a post stops early (cancelled,
+        failed write, missing ack) roll the send sequence back to the last
+        frame written, otherwise the device sees a gap and rejects the rest of
+        the session."""
+        unsent = (self.mSendSequence - self._lastSentSequence) & 0xFF
+        for n in range(1, unsent + 1):
+            fut = self._ackFutures.pop((self._lastSentSequence + n) & 0xFF, None)
+            if fut is not None and not fut.done():
+                fut.cancel()
+        self.mSendSequence = self._lastSentSequence
+
+    async def postNonData(self, encrypt: bool, checksum: bool, requireAck: bool, type: int) -> bool:
+        [(sequence, _, postBytes, _)] = self.encodePost(encrypt, checksum, requireAck, type, None)
+        await self._write(sequence, postBytes)
+        # return posted and (not requireAck or receiveAck(sequence))
+        return True
+
+    async def postContainData(self, encrypt: bool, checksum: bool, requireAck: bool, type: int, data: bytearray) -> bool:
+        for sequence, frag, postBytes, _ in self.encodePost(encrypt, checksum, requireAck, type, data):
             log.debug("sending %d bytes" % len(postBytes))
-            if requireAck:
+            ackFuture = None
+            if requireAck and frag:
                 log.debug("sending seq %d" % sequence)
-                # TODO: verify sequence when ack requested
-            await self._bleak_client.write_gatt_char(self.write_char, postBytes, True)
-            await asyncio.sleep(0.05)
+                ackFuture = self._expectAck(sequence)
+            await self._write(sequence, postBytes)
+            with self._span("inter-fragment sleep"):
+                await asyncio.sleep(0.05)
 
-            if frag:
-                # print("frag waiting")
-                if requireAck and not self.receiveAck(sequence):
+            if frag and requireAck:
+                if not await self.receiveAck(sequence, future=ackFuture):
                     return False
-                # time.sleep(10)
-                # self.esp.waitForNotifications(10)
-            else:
-                # return not requireAck or self.receiveAck(sequence)
-                pass
         return True
 
-    async def post(self, encrypt: bool, checksum: bool, requireAck: bool, type: int, data: bytearray):
+    async def post(self, encrypt: Optional[bool], checksum: Optional[bool], requireAck: bool, type: int, data: bytearray):
+        """Post one message. encrypt/checksum of None follow the security
+        policy, see setSecurityPolicy."""
+        encrypt, checksum = self._frameSecurity(type, encrypt, checksum)
         if requireAck and not self._notify_en:
             log.warning('ack requested but notifications not enabled. Incrementing read seq.')
             self.mReadSequence += 1
-        if not data or len(data) == 0:
-            await self.postNonData(encrypt, checksum, requireAck, type)
-        else:
-            await self.postContainData(encrypt, checksum, requireAck, type, data)
+        while True:
+            try:
+                try:
+                    if not data or len(data) == 0:
+                        return await self.postNonData(encrypt, checksum, requireAck, type)
+                    else:
+                        return await self.postContainData(encrypt, checksum, requireAck, type, data)
+                finally:
+                    self._rewindSendSequence()
+            except ConnectionError as e:
+                await self._await_reconnect(e)
+                if encrypt and self.mAESKey is None:
+                    raise ConnectionError("Reconnected without security, can't resend encrypted post") from e
+                # The device dropped its partial reassembly with the link, so
+                # send the whole payload again.
+                log.info("resending post of %d bytes" % (len(data) if data else 0))
 
     async def postNegotiateSecurity(self):
         type = getTypeValue(DATA.PACKAGE_VALUE, DATA.SUBTYPE_NEG)
@@ -485,7 +998,8 @@ class BlufiClient:
         txBuf.write(bytes([pgkLen1]))
         txBuf.write(bytes([pgkLen2]))
 
-        await self.post(False, False, self.mRequireAck, type, txBuf.getvalue())
+        if not await self.post(False, False, self.mRequireAck, type, txBuf.getvalue()):
+            return False
         await asyncio.sleep(0.1)
 
         txBuf.seek(0)
@@ -514,8 +1028,10 @@ class BlufiClient:
         txBuf.write(bytes([kLen2]))
         txBuf.write(kBytes)
 
-        await self.post(False, False, self.mRequireAck, type, txBuf.getvalue())
+        if not await self.post(False, False, self.mRequireAck, type, txBuf.getvalue()):
+            return False
         await asyncio.sleep(0.1)
+        return True
 
     async def postSetSecurity(self, ctrlEncrypted, ctrlChecksum, dataEncrypted, dataChecksum):
         type = getTypeValue(CTRL.PACKAGE_VALUE, CTRL.SUBTYPE_SET_SEC_MODE)
@@ -530,57 +1046,188 @@ class BlufiClient:
             data |= 0b100000
 
         postData = (data).to_bytes(1, byteorder='little')
-        await self.post(False, dataChecksum, self.mRequireAck, type, postData)
+        return await self.post(False, dataChecksum, self.mRequireAck, type, postData)
+
+    def _newCrypto(self) -> BlufiCrypto:
+        crypto = BlufiCrypto()
+        crypto.genKeys()
+        return crypto
 
-    def negotiateSecurity(self):
-        self.crypto = BlufiCrypto()
-        self.crypto.genKeys()
+    async def _negotiate_security_async(self, deadline: Deadline) -> bool:
         self.secEvent.clear()
-        self.await_bleak(self.postNegotiateSecurity())
+        self.rxPubKeyBuf = bytearray()
+        if not await self.postNegotiateSecurity():
+            log.error('negotiateSecurity: key exchange not acked')
+            return False
 
-        if not self.await_bleak(event_wait(self.secEvent, 5)):
+        with self._span("secEvent wait"):
+            secured = await self._wait_event(self.secEvent, deadline.remaining())
+        if not secured:
             log.error('negotiateSecurity failed!')
-        else:
-            log.info('negotiateSecurity success!')
-            # ctrlEncrypted, ctrlChecksum, dataEncrypted, dataChecksum
-            self.await_bleak(self.postSetSecurity(False, False, True, True))
-            self.mEncrypted = True
-            self.mChecksum = True
+            return False
+        log.info('negotiateSecurity success!')
+        # ctrlEncrypted, ctrlChecksum, dataEncrypted, dataChecksum
+        if not await self.postSetSecurity(*self.securityPolicy.deviceMode()):
+            log.error('negotiateSecurity: setting security mode failed')
+            return False
+        self.mEncrypted = True
+        self.mChecksum = True
+        return True
+
+    def negotiateSecurity(self, timeout: Optional[float] = DEFAULT_OP_TIMEOUT) -> bool:
+        """Run the DH key exchange. `timeout` covers key generation, the
+        exchange and setting the security mode."""
+        deadline = Deadline(timeout)
+        self.crypto = self._newCrypto()
+        deadline.check("negotiateSecurity")
+        return self._await_deadline(self._negotiate_security_async(deadline), deadline)
 
-    def requestVersion(self):
+    def requestVersion(self, timeout: Optional[float] = DEFAULT_OP_TIMEOUT):
         type = getTypeValue(CTRL.PACKAGE_VALUE, CTRL.SUBTYPE_GET_VERSION)
-        self.await_bleak(self.post(self.mEncrypted, self.mChecksum, False, type, None))
+        self.await_bleak(self.post(None, None, False, type, None), timeout)
 
-    def requestDeviceStatus(self):
+    def requestDeviceStatus(self, timeout: Optional[float] = DEFAULT_OP_TIMEOUT):
         type = getTypeValue(CTRL.PACKAGE_VALUE, CTRL.SUBTYPE_GET_WIFI_STATUS)
-        self.await_bleak(self.post(self.mEncrypted, self.mChecksum, False, type, None))
+        self.await_bleak(self.post(None, None, False, type, None), timeout)
 
-    def requestDeviceScan(self, timeout=10):
+    async def _request_device_scan_async(self, deadline: Deadline) -> bool:
         type = getTypeValue(CTRL.PACKAGE_VALUE, CTRL.SUBTYPE_GET_WIFI_LIST)
         self.ssidListEvent.clear()
-        self.await_bleak(self.post(self.mEncrypted, self.mChecksum, False, type, None))
-        if not self.await_bleak(event_wait(self.ssidListEvent, timeout)):
+        await self.post(None, None, False, type, None)
+        if not await self._wait_event(self.ssidListEvent, deadline.remaining()):
             log.error('parseWifiScanList timed out!')
-        else:
-            log.info('parseWifiScanList success!')
+            return False
+        log.info('parseWifiScanList success!')
+        return True
+
+    def requestDeviceScan(self, timeout: Optional[float] = DEFAULT_SCAN_TIMEOUT) -> bool:
+        deadline = Deadline(timeout)
+        return self._await_deadline(self._request_device_scan_async(deadline), deadline)
 
-    def postDeviceMode(self, opMode):
+    def postDeviceMode(self, opMode, timeout: Optional[float] = DEFAULT_OP_TIMEOUT):
         type = getTypeValue(CTRL.PACKAGE_VALUE, CTRL.SUBTYPE_SET_OP_MODE)
         data = (opMode).to_bytes(1, byteorder='little')
-        self.await_bleak(self.post(self.mEncrypted, self.mChecksum, True, type, data))
-
-    def postStaWifiInfo(self, params):
-        ssidType = getTypeValue(DATA.PACKAGE_VALUE, DATA.SUBTYPE_STA_WIFI_SSID)
-        ssidBytes = params['ssid'].encode('utf-8')
-        self.await_bleak(self.post(self.mEncrypted, self.mChecksum, self.mRequireAck, ssidType, ssidBytes))
-
-        pwdType = getTypeValue(DATA.PACKAGE_VALUE, DATA.SUBTYPE_STA_WIFI_PASSWORD)
-        pwdBytes = params['pass'].encode('utf-8')
-        self.await_bleak(self.post(self.mEncrypted, self.mChecksum, self.mRequireAck, pwdType, pwdBytes))
-
-        comfirmType = getTypeValue(CTRL.PACKAGE_VALUE, CTRL.SUBTYPE_CONNECT_WIFI)
-        self.await_bleak(self.post(False, False, self.mRequireAck, comfirmType, None))
+        return self.await_bleak(self.post(None, None, True, type, data), timeout)
+
+    def postStaWifiInfo(self, params, timeout: Optional[float] = DEFAULT_OP_TIMEOUT):
+        """params: 'ssid', 'pass' and optionally 'bssid' and 'opMode'. Sent as
+        a single transaction."""
+        txn = BlufiTransaction()
+        if 'opMode' in params:
+            txn.setOpMode(params['opMode'])
+        txn.setStaSsid(params['ssid'])
+        txn.setStaPassword(params['pass'])
+        if params.get('bssid'):
+            txn.setStaBssid(params['bssid'])
+        txn.connectWifi()
+        return self.postTransaction(txn, timeout)
+
+    def postProfile(self, profile: DeviceProfile, timeout: Optional[float] = None) -> bool:
+        """Send a DeviceProfile as one pipelined burst. Raises ValueError
+        if the profile does not validate. Certificates make profiles large, so
+        there is no deadline by default, see postTransaction."""
+        return self.postTransaction(profile.validate(), timeout)
+
+    async def sendTransaction(self, txn: BlufiTransaction) -> asyncio.Future:
+        """Encode every command of `txn`, then write the frames back to back.
+        Must run in the bleak loop. Returns a future that resolves once the
+        device has acked every frame that asked for an ack.
+        """
+        frames = []
+        for cmd in txn.commands:
+            encrypt, checksum = self._frameSecurity(cmd.type, cmd.encrypt, cmd.checksum)
+            requireAck = self.mRequireAck if cmd.requireAck is None else cmd.requireAck
+            for sequence, _, postBytes, _ in self.encodePost(encrypt, checksum, requireAck, cmd.type, cmd.data):
+                frames.append((sequence, requireAck, postBytes))
+
+        acks = []
+        try:
+            for sequence, requireAck, postBytes in frames:
+                if requireAck:
+                    if self._notify_en:
+                        acks.append(self._expectAck(sequence))
+                    else:
+                        # Same read sequence bookkeeping as post()
+                        self.mReadSequence += 1
+                await self._write(sequence, postBytes)
+        finally:
+            self._rewindSendSequence()
+        return asyncio.gather(*acks)
+
+    def _transactionEncryption(self, txn: BlufiTransaction) -> list:
+        return [self._frameSecurity(cmd.type, cmd.encrypt, cmd.checksum)[0] for cmd in txn.commands]
+
+    async def _post_transaction_async(self, txn: BlufiTransaction, deadline: Deadline) -> bool:
+        encryption = self._transactionEncryption(txn)
+        while True:
+            try:
+                acks = await self.sendTransaction(txn)
+                remaining = deadline.remaining()
+                await asyncio.wait_for(acks, ACK_TIMEOUT if remaining is None else remaining)
+                return True
+            except asyncio.TimeoutError:
+                log.error("postTransaction: acks timed out")
+                return False
+            except ConnectionError as e:
+                # Transactions carry short config commands, just send them
+                # all again on the new link, secured as they were.
+                await self._await_reconnect(e)
+                if self._transactionEncryption(txn) != encryption:
+                    raise ConnectionError("Reconnected with different security, can't resend transaction") from e
+
+    def postTransaction(self, txn: BlufiTransaction, timeout: Optional[float] = None) -> bool:
+        """Send all commands of `txn` with a single hop into the bleak thread
+        and wait for their acks. `timeout` covers writes and acks together;
+        returns False if an ack is missing at the deadline. With no timeout
+        the writes take as long as the payload needs, and the acks get
+        ACK_TIMEOUT after the last write."""
+        deadline = Deadline(timeout)
+        return self._await_deadline(self._post_transaction_async(txn, deadline), deadline)
+
+    async def _wait_sta_connection_async(self, timeout: Optional[float]) -> Optional[dict]:
+        if self.staConnResult is not None:
+            return self.staConnResult
+        fut = self._bleak_loop.create_future()
+        self._staConnWaiters.append(fut)
+        loop = asyncio.get_running_loop()
+        deadline = None if timeout is None else loop.time() + timeout
+        interval = STA_POLL_INTERVAL_MIN
+        statusType = getTypeValue(CTRL.PACKAGE_VALUE, CTRL.SUBTYPE_GET_WIFI_STATUS)
+        try:
+            while True:
+                wait = interval
+                if deadline is not None:
+                    remaining = deadline - loop.time()
+                    if remaining <= 0:
+                        log.error("waitForStaConnection timed out!")
+                        return None
+                    wait = min(interval, remaining)
+                try:
+                    return await asyncio.wait_for(asyncio.shield(fut), wait)
+                except asyncio.TimeoutError:
+                    pass
+                # Nothing pushed by the device yet, fall back to asking.
+                if self.connected:
+                    await self.post(None, None, False, statusType, None)
+                interval = min(interval * 2, STA_POLL_INTERVAL_MAX)
+        finally:
+            if fut in self._staConnWaiters:
+                self._staConnWaiters.remove(fut)
+
+    def waitForStaConnection(self, timeout: Optional[float] = 15) -> Optional[dict]:
+        """Wait for the outcome of the last postStaWifiInfo. Returns as soon as
+        the device reports STA_CONN_SUCCESS or STA_CONN_FAIL, polling the
+        status only if it stays quiet. Returns None on timeout, otherwise a
+        dict with 'success', 'staConn', 'reason' (a WIFI_REASON_* value or -1),
+        'reasonName' and 'rssi'. A timeout of None waits until the device
+        reports an outcome.
+        """
+        return self.await_bleak(self._wait_sta_connection_async(timeout),
+                                None if timeout is None else timeout + DEADLINE_GRACE)
 
-    def postCustomData(self, data: bytearray):
+    def postCustomData(self, data: bytearray, timeout: Optional[float] = None):
+        """Returns False if the device did not ack a fragment. No deadline
+        by default: the time needed grows with the payload, and each acked
+        fragment already waits at most ACK_TIMEOUT."""
         type = getTypeValue(DATA.PACKAGE_VALUE, DATA.SUBTYPE_CUSTOM_DATA)
-        self.await_bleak(self.post(self.mEncrypted, self.mChecksum, self.mRequireAck, type, data))
+        return self.await_bleak(self.post(None, None, self.mRequireAck, type, data), timeout)
@@ -15,6 +15,8 @@ FRAME_CTRL_POSITION_FRAG        = 4
 DEFAULT_PACKAGE_LENGTH = 20
 PACKAGE_HEADER_LENGTH = 4
 MIN_PACKAGE_LENGTH = 20
+# Data length is a single byte
+MAX_PACKAGE_LENGTH = PACKAGE_HEADER_LENGTH + 0xFF
 NEG_SECURITY_SET_TOTAL_LENGTH = 0x00
 NEG_SECURITY_SET_ALL_DATA = 0x01
 
@@ -85,5 +87,12 @@ WIFI_REASON_NO_AP_FOUND = 201
 WIFI_REASON_HANDSHAKE_TIMEOUT = 204
 WIFI_REASON_CONNECTION_FAIL = 205
 
+WIFI_REASON_NAMES = {
+    WIFI_REASON_4WAY_HANDSHAKE_TIMEOUT: "WIFI_REASON_4WAY_HANDSHAKE_TIMEOUT",
+    WIFI_REASON_NO_AP_FOUND: "WIFI_REASON_NO_AP_FOUND",
+    WIFI_REASON_HANDSHAKE_TIMEOUT: "WIFI_REASON_HANDSHAKE_TIMEOUT",
+    WIFI_REASON_CONNECTION_FAIL: "WIFI_REASON_CONNECTION_FAIL",
+}
+
 # Application Errors
 WIFI_SCAN_FAIL = 11
@@ -0,0 +1,195 @@
+from typing import Any, Callable, Dict, Iterable, Optional
+
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from bleak import BleakScanner
+
+from blufi.constants import BLUFI_SERVICE_UUID
+
+import logging
+log = logging.getLogger("blufi")
+
+# Devices waiting for a worker, beyond which new ones are turned away
+DEFAULT_MAX_QUEUED = 32
+
+class DiscoveryPipeline:
+    """Scans continuously for devices advertising the Blufi service and
+    hands each one to `handler` as soon as it shows up, while the scan goes
+    on.
+
+    Found devices wait in a queue of at most `maxQueued`, strongest RSSI
+    first, and each address is handled once. When the queue is full a
+    stronger newcomer replaces the weakest waiting device. Other newcomers
+    are turned away and get in on a later advertisement once there is room.
+
+    `allow` and `deny` hold addresses or names. With `allow` set, only those
+    devices are handled. `accept(device, advertisementData)` can filter
+    further. `handler(device)` may be a coroutine function, awaited on the
+    scan loop, or a plain function, run on a thread pool. It returns the
+    result recorded for the device. An exception or a False result counts as
+    a failure, and the device is tried again up to `retries` times.
+
+        def provision(device):
+            with blufi.BlufiClient() as client:
+                return client.connectByDevice(device) and client.postProfile(profile)
+
+        results = DiscoveryPipeline(provision, workers=4).run(duration=120)
+    """
+    def __init__(self, handler: Callable[[Any], Any], workers: int = 4,
+                 maxQueued: int = DEFAULT_MAX_QUEUED,
+                 allow: Optional[Iterable[str]] = None, deny: Optional[Iterable[str]] = None,
+                 accept: Optional[Callable[[Any, Any], bool]] = None,
+                 minRssi: Optional[int] = None, retries: int = 0,
+                 adapter: Optional[str] = None):
+        if workers < 1 or maxQueued < 1:
+            raise ValueError("workers and maxQueued must be >= 1")
+        self.handler = handler
+        self.workers = workers
+        self.maxQueued = maxQueued
+        self.allow = set(allow) if allow is not None else None
+        self.deny = set(deny or ())
+        self.accept = accept
+        self.minRssi = minRssi
+        self.retries = retries
+        self.adapter = adapter
+        # address -> (rssi, device) waiting for a worker
+        self._pending = {}
+        # addresses being handled or done for good
+        self._active = set()
+        self._done = set()
+        self._seen = set()
+        self._attempts = {}
+        self.results = {}
+        self.stats = dict(seen=0, queued=0, evicted=0, rejected=0, filtered=0)
+        self._ready = None
+        self._stopping = None
+
+    def _allowed(self, device, adv) -> bool:
+        names = {device.address, device.name}
+        if names & self.deny:
+            return False
+        if self.allow is not None and not names & self.allow:
+            return False
+        if self.minRssi is not None and adv.rssi < self.minRssi:
+            return False
+        return self.accept is None or self.accept(device, adv)
+
+    def _onDetect(self, device, adv) -> None:
+        """BleakScanner detection_callback, runs in the scan loop."""
+        address = device.address
+        if address in self._active or address in self._done:
+            return
+        if address in self._pending:
+            # Keep the ranking current
+            self._pending[address] = (adv.rssi, device)
+            return
+        if address not in self._seen:
+            self._seen.add(address)
+            self.stats["seen"] += 1
+        if address in self.deny:
+            # The address can't change, no need to look at it again
+            self._done.add(address)
+            self.stats["filtered"] += 1
+            return
+        if not self._allowed(device, adv):
+            # RSSI, name (often only in the scan response) and whatever
+            # accept() looks at change between advertisements, so check the
+            # next one again.
+            self.stats["filtered"] += 1
+            return
+        if len(self._pending) >= self.maxQueued:
+            weakest = min(self._pending, key=lambda a: self._pending[a][0])
+            if self._pending[weakest][0] >= adv.rssi:
+                self.stats["rejected"] += 1
+                return
+            del self._pending[weakest]
+            self.stats["evicted"] += 1
+        self._pending[address] = (adv.rssi, device)
+        self.stats["queued"] += 1
+        self._ready.set()
+
+    def _next(self):
+        address = max(self._pending, key=lambda a: self._pending[a][0])
+        rssi, device = self._pending.pop(address)
+        if not self._pending:
+            self._ready.clear()
+        self._active.add(address)
+        return device
+
+    async def _handle(self, device, executor: ThreadPoolExecutor) -> None:
+        address = device.address
+        self._attempts[address] = self._attempts.get(address, 0) + 1
+        started = time.monotonic()
+        try:
+            if asyncio.iscoroutinefunction(self.handler):
+                result = await self.handler(device)
+            else:
+                result = await asyncio.get_running_loop().run_in_executor(executor, self.handler, device)
+        except Exception as e:
+            log.error("%s: %s" % (address, e))
+            result = e
+        log.info("%s handled in %.1fs" % (address, time.monotonic() - started))
+        self.results[address] = result
+        self._active.discard(address)
+        if isinstance(result, Exception) or result is False:
+            if self._attempts[address] <= self.retries:
+                # Back into the scan, to be picked up on its next advertisement
+                return
+        self._done.add(address)
+
+    async def _worker(self, executor: ThreadPoolExecutor, limit: Optional[int]) -> None:
+        while True:
+            if limit is not None and len(self._attempts) >= limit:
+                self._stopping.set()
+                return
+            if not self._pending:
+                if self._stopping.is_set():
+                    return
+                waiter = asyncio.ensure_future(self._ready.wait())
+                stopper = asyncio.ensure_future(self._stopping.wait())
+                try:
+                    await asyncio.wait({waiter, stopper}, return_when=asyncio.FIRST_COMPLETED)
+                finally:
+                    waiter.cancel()
+                    stopper.cancel()
+                continue
+            await self._handle(self._next(), executor)
+
+    def stop(self) -> None:
+        """End the scan early. Devices already queued are still handled.
+        Must be called from the scan loop, e.g. from an async handler."""
+        if self._stopping is not None:
+            self._stopping.set()
+
+    async def arun(self, duration: Optional[float] = None, limit: Optional[int] = None) -> Dict[str, Any]:
+        """Scan for `duration` seconds or until stop(), then finish the queue.
+        With `limit`, stop as soon as that many devices have been taken on
+        instead. Returns the handler result (or exception) per address."""
+        self._ready = asyncio.Event()
+        self._stopping = asyncio.Event()
+        kwargs = dict(adapter=self.adapter) if self.adapter else {}
+        scanner = BleakScanner(detection_callback=self._onDetect,
+                               service_uuids=[BLUFI_SERVICE_UUID], **kwargs)
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            workers = [asyncio.ensure_future(self._worker(executor, limit)) for _ in range(self.workers)]
+            await scanner.start()
+            try:
+                await asyncio.wait_for(self._stopping.wait(), duration)
+            except asyncio.TimeoutError:
+                pass
+            finally:
+                await scanner.stop()
+                self._stopping.set()
+                try:
+                    await asyncio.gather(*workers)
+                except asyncio.CancelledError:
+                    for w in workers:
+                        w.cancel()
+                    raise
+        return self.results
+
+    def run(self, duration: Optional[float] = None, limit: Optional[int] = None) -> Dict[str, Any]:
+        """Blocking arun(), on a new event loop."""
+        return asyncio.run(self.arun(duration, limit))
@@ -4,9 +4,19 @@ class BluetoothError(Exception):
 class ConnectionError(BluetoothError):  # pylint: disable=redefined-builtin
     """Raised when a connection is unavailable."""
 
+class TimeoutError(BluetoothError, TimeoutError):  # pylint: disable=redefined-builtin
+    """Raised when an operation does not finish within its deadline. The
+    in-flight work has been cancelled by the time this is raised."""
+
 class RoleError(BluetoothError):
     """Raised when a resource is used as the mismatched role. For example, if a local CCCD is
     attempted to be set but it can only be set when remote."""
 
 class SecurityError(BluetoothError):
     """Raised when a security related error occurs."""
+
+class ProvisionError(BluetoothError):
+    """Raised when a provisioning phase fails."""
+    def __init__(self, phase: str, message: str):
+        super().__init__("%s: %s" % (phase, message))
+        self.phase = phase
@@ -0,0 +1,114 @@
+import collections
+import hashlib
+import struct
+import threading
+
+# Plans kept by a FragmentPlanCache, least recently used dropped first
+DEFAULT_PLAN_CACHE_ENTRIES = 128
+DEFAULT_PLAN_CACHE_BYTES = 8 * 1024 * 1024
+
+class FragmentPlan:
+    """How one payload is cut into frames for a given data length limit:
+    for each fragment its content (total-length prefix included when
+    fragmented) as a read-only memoryview, whether more follow, and the offset
+    in the payload just past it.
+
+    Built once, a plan is immutable and can be shared between clients and
+    threads. Only the per-session parts (sequence, CRC, AES) are left for
+    encoding. `dataLengthLimit` already accounts for the 2 byte prefix.
+    """
+    __slots__ = ('length', 'dataLengthLimit', 'fragments', '_buffer')
+
+    def __init__(self, payload: bytes, dataLengthLimit: int):
+        if dataLengthLimit < 1:
+            raise ValueError("dataLengthLimit must be >= 1")
+        total = len(payload)
+        payload = memoryview(payload)
+        # All fragment contents back to back in one buffer, the fragments
+        # are views into it.
+        buffer = bytearray()
+        layout = []
+        offset = 0
+        while offset < total:
+            end = min(offset + dataLengthLimit, total)
+            # Don't send a trailing fragment of <= 2 bytes, the space reserved
+            # for the frag header fits it in this frame instead.
+            if total - end <= 2:
+                end = total
+            frag = end < total
+            start = len(buffer)
+            if frag:
+                buffer += struct.pack("<H", total - offset)
+            buffer += payload[offset:end]
+            layout.append((start, len(buffer), frag, end))
+            offset = end
+        self._buffer = bytes(buffer)
+        view = memoryview(self._buffer)
+        self.fragments = tuple((view[start:stop], frag, end) for start, stop, frag, end in layout)
+        self.length = total
+        self.dataLengthLimit = dataLengthLimit
+
+    def __len__(self):
+        return len(self.fragments)
+
+    def __repr__(self):
+        return "FragmentPlan(len=%d, limit=%d, fragments=%d)" % (self.length, self.dataLengthLimit, len(self.fragments))
+
+    def size(self) -> int:
+        return len(self._buffer)
+
+class FragmentPlanCache:
+    """LRU store of FragmentPlans keyed by payload digest and data length
+    limit, so posting the same certificate or config blob to many devices
+    cuts it up only once. Thread safe. Bounded by `maxEntries` plans and
+    `maxBytes` of fragment data.
+    """
+    def __init__(self, maxEntries: int = DEFAULT_PLAN_CACHE_ENTRIES, maxBytes: int = DEFAULT_PLAN_CACHE_BYTES):
+        self.maxEntries = maxEntries
+        self.maxBytes = maxBytes
+        self._plans = collections.OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _key(payload, dataLengthLimit: int):
+        return hashlib.sha256(payload).digest(), len(payload), dataLengthLimit
+
+    def get(self, payload, dataLengthLimit: int) -> FragmentPlan:
+        """The plan for `payload`, built and stored on first use."""
+        key = self._key(payload, dataLengthLimit)
+        with self._lock:
+            plan = self._plans.get(key)
+            if plan is not None:
+                self._plans.move_to_end(key)
+                self.hits += 1
+                return plan
+            self.misses += 1
+        # Build outside the lock, two threads racing on the same payload
+        # just build it twice.
+        plan = FragmentPlan(payload, dataLengthLimit)
+        if plan.size() > self.maxBytes:
+            return plan
+        with self._lock:
+            if key not in self._plans:
+                self._plans[key] = plan
+                self._bytes += plan.size()
+                while len(self._plans) > self.maxEntries or self._bytes > self.maxBytes:
+                    _, old = self._plans.popitem(last=False)
+                    self._bytes -= old.size()
+        return plan
+
+    def clear(self) -> None:
+        with self._lock:
+            self._plans.clear()
+            self._bytes = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"entries": len(self._plans), "bytes": self._bytes,
+                    "hits": self.hits, "misses": self.misses}
+
+# Shared by all clients unless they are given their own
+defaultPlanCache = FragmentPlanCache()
@@ -0,0 +1,103 @@
+from typing import Optional
+
+import collections
+import threading
+
+from blufi.constants import MAX_PACKAGE_LENGTH, MIN_PACKAGE_LENGTH
+
+import logging
+log = logging.getLogger("blufi")
+
+# Learned package length per device address, shared by all clients in the
+# process so a device that reconnects (or is provisioned again) starts at the
+# size that worked last time. Least recently used addresses are dropped
+# beyond MAX_LEARNED_SIZES.
+MAX_LEARNED_SIZES = 4096
+_learnedSizes = collections.OrderedDict()
+_learnedLock = threading.Lock()
+
+def learnedPackageLength(address: str) -> Optional[int]:
+    with _learnedLock:
+        size = _learnedSizes.get(address)
+        if size is not None:
+            _learnedSizes.move_to_end(address)
+        return size
+
+def forgetPackageLengths() -> None:
+    with _learnedLock:
+        _learnedSizes.clear()
+
+class FragmentSizer:
+    """Picks the package length used to fragment posts from how the link
+    behaves, additive increase / multiplicative decrease style.
+
+    After `growAfter` writes in a row that completed within `targetLatency`
+    seconds the length grows by `step`. A retransmit, missing ack, failed
+    write or CRC error cuts it by `backoff`. It always stays within
+    [minimum, maximum], and maximum is capped by the protocol's one-byte data
+    length. Growing back up to a length that failed before takes
+    `probeFactor` times as many good writes, so it settles just below the
+    link's limit instead of oscillating around it.
+    """
+    def __init__(self, initial: Optional[int] = None, minimum: int = MIN_PACKAGE_LENGTH,
+                 maximum: int = MAX_PACKAGE_LENGTH, step: int = 16, growAfter: int = 4,
+                 targetLatency: float = 0.1, backoff: float = 0.5, probeFactor: int = 16):
+        self.minimum = max(minimum, MIN_PACKAGE_LENGTH)
+        self.maximum = min(maximum, MAX_PACKAGE_LENGTH)
+        self.step = step
+        self.growAfter = growAfter
+        self.targetLatency = targetLatency
+        self.backoff = backoff
+        self.probeFactor = probeFactor
+        self.initial = self.minimum if initial is None else initial
+        self.address = None
+        self._size = self._clamp(self.initial)
+        self._fastWrites = 0
+        # Smallest length that has failed so far
+        self._failedAt = None
+
+    def _clamp(self, size: int) -> int:
+        return max(self.minimum, min(int(size), self.maximum))
+
+    def attach(self, address: str) -> None:
+        """Start from what was learned for `address`, and keep learning for it."""
+        self.address = address
+        learned = learnedPackageLength(address)
+        self._size = self._clamp(self.initial if learned is None else learned)
+        self._fastWrites = 0
+        self._failedAt = None
+
+    def _remember(self) -> None:
+        if self.address is not None:
+            with _learnedLock:
+                _learnedSizes[self.address] = self._size
+                _learnedSizes.move_to_end(self.address)
+                while len(_learnedSizes) > MAX_LEARNED_SIZES:
+                    _learnedSizes.popitem(last=False)
+
+    def packageLength(self) -> int:
+        return self._size
+
+    def onWrite(self, latency: float) -> None:
+        if latency > self.targetLatency:
+            self._fastWrites = 0
+            return
+        self._fastWrites += 1
+        needed = self.growAfter
+        if self._failedAt is not None and self._size + self.step >= self._failedAt:
+            needed *= self.probeFactor
+        if self._fastWrites >= needed and self._size < self.maximum:
+            self._fastWrites = 0
+            self._size = self._clamp(self._size + self.step)
+            log.debug("fragment size up to %d" % self._size)
+            self._remember()
+
+    def onError(self, reason: str = "") -> None:
+        self._fastWrites = 0
+        if self._failedAt is None or self._size < self._failedAt:
+            self._failedAt = self._size
+        size = self._clamp(self._size * self.backoff)
+        if size != self._size:
+            self._size = size
+            log.debug("fragment size down to %d (%s)" % (self._size, reason))
+        self._remember()
@@ -0,0 +1,284 @@
+from typing import Callable, Iterable, Optional
+
+import json
+import socket
+import sqlite3
+import threading
+import time
+
+from blufi.client import BlufiClient
+from blufi.utils import LoopThread
+from blufi.constants import OP_MODE_STA
+from blufi.exceptions import ProvisionError
+
+import logging
+log = logging.getLogger("blufi")
+
+# Provisioning phases, in order. connect and negotiate only produce state for
+# the current BLE session, so they are redone on every attempt. The others
+# change the device and are skipped once recorded as completed.
+PHASE_CONNECT = "connect"
+PHASE_NEGOTIATE = "negotiate"
+PHASE_MODE = "mode"
+PHASE_WIFI = "wifi"
+PHASE_VERIFY = "verify"
+PHASES = (PHASE_CONNECT, PHASE_NEGOTIATE, PHASE_MODE, PHASE_WIFI, PHASE_VERIFY)
+SESSION_PHASES = (PHASE_CONNECT, PHASE_NEGOTIATE)
+# Phase a job falls back to when the given phase fails. A failed verify
+# (wrong password, device rebooted, ...) means the credentials have to be
+# sent again, so it undoes wifi too.
+ROLLBACK_ON_FAILURE = {PHASE_VERIFY: PHASE_MODE}
+
+JOB_PENDING = "pending"
+JOB_RUNNING = "running"
+JOB_DONE = "done"
+JOB_FAILED = "failed"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    device TEXT PRIMARY KEY,
+    params TEXT NOT NULL,
+    status TEXT NOT NULL,
+    phase TEXT NOT NULL DEFAULT '',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    error TEXT,
+    timings TEXT NOT NULL DEFAULT '{}',
+    owner TEXT,
+    created REAL NOT NULL,
+    updated REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS jobs_status ON jobs(status);
+CREATE TABLE IF NOT EXISTS phase_log (
+    device TEXT NOT NULL,
+    phase TEXT NOT NULL,
+    attempt INTEGER NOT NULL,
+    started REAL NOT NULL,
+    duration REAL NOT NULL,
+    ok INTEGER NOT NULL,
+    error TEXT
+);
+"""
+
+class ProvisioningJob:
+    def __init__(self, device: str, params: dict, phase: str, attempts: int, timings: dict):
+        self.device = device
+        self.params = params
+        # Last completed phase, '' if none
+        self.phase = phase
+        self.attempts = attempts
+        self.timings = timings
+
+    def isCompleted(self, phase: str) -> bool:
+        if not self.phase:
+            return False
+        return PHASES.index(phase) <= PHASES.index(self.phase)
+
+    def __repr__(self):
+        return "ProvisioningJob(%s, phase=%r, attempts=%d)" % (self.device, self.phase, self.attempts)
+
+class JobStore:
+    """SQLite-backed record of provisioning jobs.
+
+    Writes are grouped into one transaction that is committed every
+    `batchSize` writes or `flushInterval` seconds, whichever comes first, and
+    on flush()/close(). A crash loses at most the last uncommitted batch,
+    which only means redoing those phases. Safe to share between threads.
+    """
+    def __init__(self, path: str, batchSize: int = 32, flushInterval: float = 1.0):
+        self.path = path
+        self.batchSize = batchSize
+        self.flushInterval = flushInterval
+        self._lock = threading.RLock()
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.executescript(_SCHEMA)
+        self._pending = 0
+        self._lastFlush = time.monotonic()
+
+    def _write(self, sql: str, args=()) -> sqlite3.Cursor:
+        with self._lock:
+            if not self._db.in_transaction:
+                self._db.execute("BEGIN")
+            cur = self._db.execute(sql, args)
+            self._pending += 1
+            if self._pending >= self.batchSize or time.monotonic() - self._lastFlush >= self.flushInterval:
+                self.flush()
+            return cur
+
+    def flush(self) -> None:
+        with self._lock:
+            if self._db.in_transaction:
+                self._db.execute("COMMIT")
+            self._pending = 0
+            self._lastFlush = time.monotonic()
+
+    def close(self) -> None:
+        with self._lock:
+            self.flush()
+            self._db.close()
+
+    def addJobs(self, devices: Iterable[str], params: dict) -> None:
+        """Queue devices that are not in the store yet. Existing jobs, finished
+        or not, are left alone so a rerun of the same batch resumes it."""
+        now = time.time()
+        with self._lock:
+            for device in devices:
+                self._write("INSERT OR IGNORE INTO jobs (device, params, status, created, updated) "
+                            "VALUES (?, ?, ?, ?, ?)", (device, json.dumps(params), JOB_PENDING, now, now))
+            self.flush()
+
+    def recover(self, maxAttempts: Optional[int] = None) -> int:
+        """Return jobs left running by a crashed or interrupted run to the
+        queue. With `maxAttempts`, jobs that have used up their attempts are
+        marked failed instead, as claim() would never pick them up again.
+        Returns the number of jobs returned to the queue."""
+        with self._lock:
+            if maxAttempts is not None:
+                self._write("UPDATE jobs SET status = ?, owner = NULL, error = ?, updated = ? "
+                            "WHERE status IN (?, ?) AND attempts >= ?",
+                            (JOB_FAILED, "interrupted on last attempt", time.time(),
+                             JOB_PENDING, JOB_RUNNING, maxAttempts))
+            cur = self._write("UPDATE jobs SET status = ?, owner = NULL WHERE status = ?",
+                              (JOB_PENDING, JOB_RUNNING))
+            self.flush()
+            return cur.rowcount
+
+    def claim(self, owner: str, maxAttempts: int) -> Optional[ProvisioningJob]:
+        """Take the next pending job, or None when there is nothing left."""
+        with self._lock:
+            row = self._db.execute(
+                "SELECT device, params, phase, attempts, timings FROM jobs "
+                "WHERE status = ? AND attempts < ? ORDER BY attempts, created LIMIT 1",
+                (JOB_PENDING, maxAttempts)).fetchone()
+            if row is None:
+                return None
+            device, params, phase, attempts, timings = row
+            attempts += 1
+            self._write("UPDATE jobs SET status = ?, owner = ?, attempts = ?, updated = ? WHERE device = ?",
+                        (JOB_RUNNING, owner, attempts, time.time(), device))
+            return ProvisioningJob(device, json.loads(params), phase, attempts, json.loads(timings))
+
+    def recordPhase(self, job: ProvisioningJob, phase: str, started: float, duration: float,
+                    error: Optional[str] = None) -> None:
+        with self._lock:
+            self._write("INSERT INTO phase_log VALUES (?, ?, ?, ?, ?, ?, ?)",
+                        (job.device, phase, job.attempts, started, duration, error is None, error))
+            if error is None and phase not in SESSION_PHASES:
+                job.phase = phase
+            elif error is not None and phase in ROLLBACK_ON_FAILURE:
+                job.phase = ROLLBACK_ON_FAILURE[phase]
+            job.timings[phase] = round(duration, 4)
+            self._write("UPDATE jobs SET phase = ?, timings = ?, updated = ? WHERE device = ?",
+                        (job.phase, json.dumps(job.timings), time.time(), job.device))
+
+    def finish(self, job: ProvisioningJob, error: Optional[str] = None, maxAttempts: int = 1) -> None:
+        """Mark a claimed job done, or failed. A failed job with attempts
+        left goes back to pending."""
+        if error is None:
+            status = JOB_DONE
+        else:
+            status = JOB_PENDING if job.attempts < maxAttempts else JOB_FAILED
+        with self._lock:
+            self._write("UPDATE jobs SET status = ?, error = ?, owner = NULL, updated = ? WHERE device = ?",
+                        (status, error, time.time(), job.device))
+
+    def counts(self) -> dict:
+        with self._lock:
+            return dict(self._db.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall())
+
+    def phaseStats(self) -> dict:
+        """Per phase: number of runs, failures and mean duration."""
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT phase, COUNT(*), SUM(1 - ok), AVG(duration) FROM phase_log GROUP BY phase").fetchall()
+        return {phase: {"runs": runs, "failures": failures, "mean": mean}
+                for phase, runs, failures, mean in rows}
+
+class ProvisioningRunner:
+    """Pulls jobs from a JobStore on several worker threads and runs
+    connect, negotiateSecurity, postDeviceMode, postStaWifiInfo and a
+    connection check on each, resuming from the last completed phase.
+
+    Job params: 'ssid', 'pass', optional 'bssid', 'opMode' (defaults to
+    OP_MODE_STA) and 'verifyTimeout' in seconds.
+    """
+    def __init__(self, store: JobStore, clientFactory: Optional[Callable[[ProvisioningJob], BlufiClient]] = None,
+                 workers: int = 4, maxAttempts: int = 3):
+        self.store = store
+        self.clientFactory = clientFactory or self._defaultClient
+        self.workers = workers
+        self.maxAttempts = maxAttempts
+        # Loop shared by the default clients while run() is going
+        self._loop = None
+
+    def _defaultClient(self, job: ProvisioningJob) -> BlufiClient:
+        return BlufiClient(loop=self._loop)
+
+    def _phase(self, job: ProvisioningJob, phase: str, fn: Callable[[], bool]) -> None:
+        if phase not in SESSION_PHASES and job.isCompleted(phase):
+            log.info("%s: %s already done" % (job.device, phase))
+            return
+        started = time.time()
+        t0 = time.monotonic()
+        error = None
+        try:
+            if not fn():
+                error = "failed"
+        except Exception as e:
+            error = str(e) or type(e).__name__
+        self.store.recordPhase(job, phase, started, time.monotonic() - t0, error)
+        if error is not None:
+            raise ProvisionError(phase, error)
+
+    def provision(self, job: ProvisioningJob) -> None:
+        params = job.params
+        client = self.clientFactory(job)
+        try:
+            self._phase(job, PHASE_CONNECT, lambda: client.connectByName(job.device))
+            self._phase(job, PHASE_NEGOTIATE, client.negotiateSecurity)
+            self._phase(job, PHASE_MODE,
+                        lambda: client.postDeviceMode(params.get('opMode', OP_MODE_STA)) is not False)
+            self._phase(job, PHASE_WIFI, lambda: client.postStaWifiInfo(params))
+
+            def verify():
+                result = client.waitForStaConnection(params.get('verifyTimeout', 15))
+                if result is None:
+                    raise RuntimeError("no connection state")
+                if not result["success"]:
+                    raise RuntimeError(result["reasonName"] or "reason %d" % result["reason"])
+                return True
+            self._phase(job, PHASE_VERIFY, verify)
+        finally:
+            client.close()
+
+    def _worker(self, owner: str) -> None:
+        while True:
+            job = self.store.claim(owner, self.maxAttempts)
+            if job is None:
+                return
+            log.info("%s: attempt %d, resuming after %r" % (job.device, job.attempts, job.phase or None))
+            try:
+                self.provision(job)
+            except Exception as e:
+                log.error("%s: %s" % (job.device, e))
+                self.store.finish(job, str(e), self.maxAttempts)
+            else:
+                self.store.finish(job)
+
+    def run(self) -> dict:
+        """Process every pending job, then return the per-status counts."""
+        self.store.recover(self.maxAttempts)
+        prefix = "%s:%d" % (socket.gethostname(), threading.get_ident())
+        threads = [threading.Thread(target=self._worker, args=("%s/%d" % (prefix, n),), daemon=True)
+                   for n in range(self.workers)]
+        self._loop = LoopThread()
+        try:
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+        finally:
+            self._loop.stop()
+            self._loop = None
+        self.store.flush()
+        return self.store.counts()
@@ -0,0 +1,76 @@
+from typing import Tuple
+
+from blufi.constants import *
+from blufi.framectrl import getPackageType, getSubType
+
+# Message classes a SecurityPolicy distinguishes
+MSG_CTRL = "ctrl"
+MSG_CREDENTIAL = "credential"
+MSG_BULK = "bulk"
+
+CREDENTIAL_SUBTYPES = frozenset((
+    DATA.SUBTYPE_STA_WIFI_BSSID,
+    DATA.SUBTYPE_STA_WIFI_SSID,
+    DATA.SUBTYPE_STA_WIFI_PASSWORD,
+    DATA.SUBTYPE_SOFTAP_WIFI_SSID,
+    DATA.SUBTYPE_SOFTAP_WIFI_PASSWORD,
+    DATA.SUBTYPE_USERNAME,
+    DATA.SUBTYPE_CLIENT_PRIVATE_KEY,
+    DATA.SUBTYPE_SERVER_PRIVATE_KEY,
+))
+BULK_SUBTYPES = frozenset((
+    DATA.SUBTYPE_CUSTOM_DATA,
+    DATA.SUBTYPE_CA_CERTIFICATION,
+    DATA.SUBTYPE_CLIENT_CERTIFICATION,
+    DATA.SUBTYPE_SERVER_CERTIFICATION,
+))
+
+def classify(type: int) -> str:
+    """Message class of a frame type. CTRL frames and the small DATA settings
+    (SoftAP channel, auth mode, ...) are ctrl."""
+    if getPackageType(type) == DATA.PACKAGE_VALUE:
+        subType = getSubType(type)
+        if subType in CREDENTIAL_SUBTYPES:
+            return MSG_CREDENTIAL
+        if subType in BULK_SUBTYPES:
+            return MSG_BULK
+    return MSG_CTRL
+
+class SecurityPolicy:
+    """Which frames get AES encryption and a CRC once security has been
+    negotiated, per message class: ctrl (commands and small settings),
+    credential (SSIDs, passwords, private keys) and bulk (custom data and
+    certificates).
+
+    Credentials are always encrypted. The defaults leave ctrl frames
+    unencrypted: they carry nothing secret, and each AES frame costs CPU on
+    both ends. Encrypting bulk data can be turned off for non-sensitive
+    traffic like telemetry.
+
+    The device is told to answer with the ctrl settings for its CTRL frames
+    and the bulk settings for its DATA frames.
+    """
+    def __init__(self, ctrlEncrypt: bool = False, ctrlChecksum: bool = True,
+                 credentialChecksum: bool = True,
+                 bulkEncrypt: bool = True, bulkChecksum: bool = True):
+        self._choices = {
+            MSG_CTRL: (ctrlEncrypt, ctrlChecksum),
+            MSG_CREDENTIAL: (True, credentialChecksum),
+            MSG_BULK: (bulkEncrypt, bulkChecksum),
+        }
+
+    def __repr__(self):
+        return "SecurityPolicy(%s)" % ", ".join(
+            "%s=%s%s" % (cls, "aes" if enc else "plain", "+crc" if chk else "")
+            for cls, (enc, chk) in self._choices.items())
+
+    def choose(self, type: int) -> Tuple[bool, bool]:
+        """(encrypt, checksum) for a frame of `type`."""
+        return self._choices[classify(type)]
+
+    def deviceMode(self) -> Tuple[bool, bool, bool, bool]:
+        """Arguments for BlufiClient.postSetSecurity: ctrlEncrypted,
+        ctrlChecksum, dataEncrypted, dataChecksum."""
+        ctrl = self._choices[MSG_CTRL]
+        bulk = self._choices[MSG_BULK]
+        return ctrl[0], ctrl[1], bulk[0], bulk[1]
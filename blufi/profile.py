@@ -0,0 +1,165 @@
+from typing import Optional
+
+from blufi.constants import *
+from blufi.transaction import BlufiTransaction
+
+SSID_MAX_LENGTH = 32
+PASSWORD_MAX_LENGTH = 64
+WPA_PASSWORD_MIN_LENGTH = 8
+SOFTAP_MAX_CONNECTION = 10
+SOFTAP_CHANNEL_MIN = 1
+SOFTAP_CHANNEL_MAX = 14
+SOFTAP_SECURITIES = (SOFTAP_SECURITY_OPEN, SOFTAP_SECURITY_WEP, SOFTAP_SECURITY_WPA,
+                     SOFTAP_SECURITY_WPA2, SOFTAP_SECURITY_WPA_WPA2)
+
+class DeviceProfile:
+    """Everything to configure on a device: op mode, station (optionally WPA2
+    enterprise) and SoftAP settings.
+
+    validate() checks the profile once and encodes it into a
+    BlufiTransaction. BlufiClient.postProfile sends that as one burst with a
+    single ack wait at the end. The same profile can be posted to any number
+    of devices.
+
+    opMode defaults to STA, SOFTAP or STASOFTAP depending on which settings
+    are given. `connect` sends CTRL.SUBTYPE_CONNECT_WIFI after the station
+    settings.
+    """
+    def __init__(self,
+                 opMode: Optional[int] = None,
+                 staSsid: Optional[str] = None,
+                 staPassword: Optional[str] = None,
+                 staBssid=None,
+                 staMaxConnRetry: Optional[int] = None,
+                 username: Optional[str] = None,
+                 caCert: Optional[bytes] = None,
+                 clientCert: Optional[bytes] = None,
+                 clientKey: Optional[bytes] = None,
+                 softapSsid: Optional[str] = None,
+                 softapPassword: Optional[str] = None,
+                 softapAuthMode: Optional[int] = None,
+                 softapChannel: Optional[int] = None,
+                 softapMaxConnection: Optional[int] = None,
+                 connect: bool = True):
+        self.opMode = opMode
+        self.staSsid = staSsid
+        self.staPassword = staPassword
+        self.staBssid = staBssid
+        self.staMaxConnRetry = staMaxConnRetry
+        self.username = username
+        self.caCert = caCert
+        self.clientCert = clientCert
+        self.clientKey = clientKey
+        self.softapSsid = softapSsid
+        self.softapPassword = softapPassword
+        self.softapAuthMode = softapAuthMode
+        self.softapChannel = softapChannel
+        self.softapMaxConnection = softapMaxConnection
+        self.connect = connect
+        self._txn = None
+
+    def __setattr__(self, name, value):
+        # Any change invalidates the transaction validate() cached
+        object.__setattr__(self, name, value)
+        if name != '_txn':
+            object.__setattr__(self, '_txn', None)
+
+    def _hasSta(self) -> bool:
+        return self.staSsid is not None
+
+    def _hasSoftap(self) -> bool:
+        return any(v is not None for v in (self.softapSsid, self.softapPassword, self.softapAuthMode,
+                                           self.softapChannel, self.softapMaxConnection))
+
+    @staticmethod
+    def _checkSsid(name: str, ssid: str) -> None:
+        if not 0 < len(ssid.encode('utf-8')) <= SSID_MAX_LENGTH:
+            raise ValueError("%s must be 1-%d bytes" % (name, SSID_MAX_LENGTH))
+
+    @staticmethod
+    def _checkByte(name: str, value: int, low: int, high: int) -> None:
+        if not low <= value <= high:
+            raise ValueError("%s must be %d-%d, got %d" % (name, low, high, value))
+
+    def validate(self) -> BlufiTransaction:
+        """Check the profile and return its encoded commands. Raises
+        ValueError on the first problem found. The result is cached until a
+        field of the profile is changed."""
+        if self._txn is not None:
+            return self._txn
+
+        opMode = self.opMode
+        if opMode is None:
+            if self._hasSta() and self._hasSoftap():
+                opMode = OP_MODE_STASOFTAP
+            elif self._hasSoftap():
+                opMode = OP_MODE_SOFTAP
+            else:
+                opMode = OP_MODE_STA
+        if opMode not in (OP_MODE_NULL, OP_MODE_STA, OP_MODE_SOFTAP, OP_MODE_STASOFTAP):
+            raise ValueError("invalid opMode %r" % opMode)
+        staMode = opMode in (OP_MODE_STA, OP_MODE_STASOFTAP)
+        softapMode = opMode in (OP_MODE_SOFTAP, OP_MODE_STASOFTAP)
+
+        txn = BlufiTransaction().setOpMode(opMode)
+
+        if staMode:
+            if not self._hasSta():
+                raise ValueError("staSsid is required in op mode %d" % opMode)
+            self._checkSsid("staSsid", self.staSsid)
+            txn.setStaSsid(self.staSsid)
+            if self.staPassword is not None:
+                if len(self.staPassword.encode('utf-8')) > PASSWORD_MAX_LENGTH:
+                    raise ValueError("staPassword must be at most %d bytes" % PASSWORD_MAX_LENGTH)
+                txn.setStaPassword(self.staPassword)
+            if self.staBssid is not None:
+                txn.setStaBssid(self.staBssid)
+            if self.staMaxConnRetry is not None:
+                self._checkByte("staMaxConnRetry", self.staMaxConnRetry, 0, 0xff)
+                txn.setStaMaxConnRetry(self.staMaxConnRetry)
+            if self.username is not None:
+                txn.setUsername(self.username)
+            if self.caCert is not None:
+                txn.setCaCert(self.caCert)
+            if (self.clientCert is None) != (self.clientKey is None):
+                raise ValueError("clientCert and clientKey go together")
+            if self.clientCert is not None:
+                txn.setClientCert(self.clientCert)
+                txn.setClientKey(self.clientKey)
+        elif self._hasSta():
+            raise ValueError("station settings given but op mode %d has no station" % opMode)
+
+        if softapMode:
+            if self.softapSsid is not None:
+                self._checkSsid("softapSsid", self.softapSsid)
+                txn.setSoftapSsid(self.softapSsid)
+            authMode = self.softapAuthMode
+            if authMode is not None and authMode not in SOFTAP_SECURITIES:
+                raise ValueError("invalid softapAuthMode %r" % authMode)
+            if self.softapPassword is not None:
+                length = len(self.softapPassword.encode('utf-8'))
+                if authMode == SOFTAP_SECURITY_OPEN and length > 0:
+                    raise ValueError("softapPassword given for an open SoftAP")
+                if authMode in (SOFTAP_SECURITY_WPA, SOFTAP_SECURITY_WPA2, SOFTAP_SECURITY_WPA_WPA2) and \
+                        not WPA_PASSWORD_MIN_LENGTH <= length <= PASSWORD_MAX_LENGTH:
+                    raise ValueError("softapPassword must be %d-%d bytes for WPA" %
+                                     (WPA_PASSWORD_MIN_LENGTH, PASSWORD_MAX_LENGTH))
+                txn.setSoftapPassword(self.softapPassword)
+            elif authMode not in (None, SOFTAP_SECURITY_OPEN):
+                raise ValueError("softapPassword is required unless the SoftAP is open")
+            if authMode is not None:
+                txn.setSoftapAuthMode(authMode)
+            if self.softapChannel is not None:
+                self._checkByte("softapChannel", self.softapChannel, SOFTAP_CHANNEL_MIN, SOFTAP_CHANNEL_MAX)
+                txn.setSoftapChannel(self.softapChannel)
+            if self.softapMaxConnection is not None:
+                self._checkByte("softapMaxConnection", self.softapMaxConnection, 1, SOFTAP_MAX_CONNECTION)
+                txn.setSoftapMaxConnection(self.softapMaxConnection)
+        elif self._hasSoftap():
+            raise ValueError("SoftAP settings given but op mode %d has no SoftAP" % opMode)
+
+        if staMode and self.connect:
+            txn.connectWifi()
+
+        self._txn = txn.ackLastOnly()
+        return self._txn
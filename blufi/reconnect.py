@@ -0,0 +1,30 @@
+from typing import Iterator
+
+import random
+
+class ReconnectPolicy:
+    """How BlufiClient recovers from a dropped link.
+
+    Up to `maxAttempts` reconnects are tried, waiting `initialDelay` seconds
+    before the first and multiplying the wait by `factor` after each failure,
+    up to `maxDelay`. Waits are jittered by +/- `jitter` (a fraction) so a
+    rack of devices dropping at once does not reconnect in lockstep.
+    With `renegotiate` set, security is negotiated again when the lost session
+    had it, which is needed for encrypted posts to be resent.
+    """
+    def __init__(self, maxAttempts: int = 5, initialDelay: float = 0.5, maxDelay: float = 8.0,
+                 factor: float = 2.0, jitter: float = 0.1, connectTimeout: float = 10.0,
+                 renegotiate: bool = True):
+        self.maxAttempts = maxAttempts
+        self.initialDelay = initialDelay
+        self.maxDelay = maxDelay
+        self.factor = factor
+        self.jitter = jitter
+        self.connectTimeout = connectTimeout
+        self.renegotiate = renegotiate
+
+    def delays(self) -> Iterator[float]:
+        delay = self.initialDelay
+        for _ in range(self.maxAttempts):
+            yield delay * random.uniform(1 - self.jitter, 1 + self.jitter)
+            delay = min(delay * self.factor, self.maxDelay)
@@ -0,0 +1,169 @@
+from typing import Callable, Dict, Iterable, List, Optional, Union
+
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+from blufi.exceptions import ConnectionError
+
+import logging
+log = logging.getLogger("blufi")
+
+# Concurrent connections a single HCI controller is assumed to handle when no
+# capacity is given. Most USB dongles manage 4-7 before connects start failing.
+DEFAULT_ADAPTER_CAPACITY = 4
+
+class _AdapterSlot:
+    def __init__(self, name: str, capacity: int):
+        self.name = name
+        self.capacity = capacity
+        self.active = 0
+        self.connections = 0
+        self.failures = 0
+        self.consecutiveFailures = 0
+        self.suspendedUntil = 0.0
+
+    def isSuspended(self, now: float) -> bool:
+        return self.suspendedUntil > now
+
+    def load(self) -> float:
+        return self.active / self.capacity
+
+class AdapterScheduler:
+    """Assigns device connections to the least-loaded of several local BLE
+    controllers (e.g. hci0, hci1, ...).
+
+    Each adapter has a capacity, the number of connections it is allowed to
+    hold at once. An adapter that fails `failureThreshold` connections in a row
+    is suspended for `cooldown` seconds, so new work goes to its siblings.
+    Nothing here touches bleak directly: the caller opens the connection for
+    the adapter it was handed, which keeps the scheduler usable with a fake
+    transport.
+    """
+    def __init__(self, adapters: Union[Dict[str, int], Iterable[str]],
+                 failureThreshold: int = 3, cooldown: float = 30.0):
+        if isinstance(adapters, dict):
+            items = list(adapters.items())
+        else:
+            items = [(name, DEFAULT_ADAPTER_CAPACITY) for name in adapters]
+        if not items:
+            raise ValueError("AdapterScheduler needs at least one adapter")
+        self._slots = {}
+        for name, capacity in items:
+            if capacity < 1:
+                raise ValueError("adapter %s: capacity must be >= 1" % name)
+            self._slots[name] = _AdapterSlot(name, capacity)
+        self.failureThreshold = failureThreshold
+        self.cooldown = cooldown
+        self._cond = threading.Condition()
+
+    def _pick(self, exclude) -> Optional[_AdapterSlot]:
+        now = time.monotonic()
+        free = [s for s in self._slots.values()
+                if s.active < s.capacity and s.name not in exclude]
+        if not free:
+            return None
+        # Prefer adapters that are not cooling down after a run of failures,
+        # but fall back to them rather than starving the caller.
+        healthy = [s for s in free if not s.isSuspended(now)]
+        candidates = healthy or free
+        return min(candidates, key=lambda s: (s.load(), s.consecutiveFailures, s.active))
+
+    def acquire(self, timeout: Optional[float] = None, exclude: Iterable[str] = ()) -> str:
+        """Reserve a connection slot and return the adapter name to use.
+        Blocks until a slot is free. Adapters in `exclude` are skipped unless
+        they are the only ones configured.
+        """
+        exclude = set(exclude)
+        if exclude.issuperset(self._slots):
+            exclude = set()
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            while True:
+                slot = self._pick(exclude)
+                if slot is not None:
+                    slot.active += 1
+                    slot.connections += 1
+                    return slot.name
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    raise ConnectionError("No adapter slot available")
+                self._cond.wait(remaining)
+
+    def release(self, adapter: str, success: bool = True) -> None:
+        """Return a slot taken with acquire(), recording whether the work on it
+        succeeded."""
+        with self._cond:
+            slot = self._slots[adapter]
+            slot.active = max(slot.active - 1, 0)
+            if success:
+                slot.consecutiveFailures = 0
+            else:
+                slot.failures += 1
+                slot.consecutiveFailures += 1
+                if slot.consecutiveFailures >= self.failureThreshold:
+                    log.warning("adapter %s: %d failures in a row, suspending for %.1fs" %
+                                (adapter, slot.consecutiveFailures, self.cooldown))
+                    slot.suspendedUntil = time.monotonic() + self.cooldown
+            self._cond.notify_all()
+
+    @contextmanager
+    def slot(self, timeout: Optional[float] = None, exclude: Iterable[str] = ()):
+        """Context manager around acquire()/release(). An exception raised in
+        the body counts as a failure for the adapter."""
+        adapter = self.acquire(timeout, exclude)
+        success = False
+        try:
+            yield adapter
+            success = True
+        finally:
+            self.release(adapter, success)
+
+    def map(self, devices: Iterable, fn: Callable, retries: int = 1) -> List:
+        """Run `fn(device, adapter)` for every device, as many at once as the
+        adapters have capacity for. A device whose attempt raises or returns
+        False is retried up to `retries` times, on a different adapter when one
+        is available. Returns one entry per device, in order: fn's result, or
+        the exception of its last attempt.
+        """
+        devices = list(devices)
+        workers = sum(s.capacity for s in self._slots.values())
+
+        def run(device):
+            tried = []
+            result = None
+            for _ in range(retries + 1):
+                adapter = self.acquire(exclude=tried)
+                tried.append(adapter)
+                try:
+                    result = fn(device, adapter)
+                except Exception as e:
+                    log.error("%s on %s: %s" % (device, adapter, e))
+                    result = e
+                success = not isinstance(result, Exception) and result is not False
+                self.release(adapter, success)
+                if success:
+                    break
+            return result
+
+        if not devices:
+            return []
+        with ThreadPoolExecutor(max_workers=min(workers, len(devices))) as pool:
+            return list(pool.map(run, devices))
+
+    def utilization(self) -> Dict[str, dict]:
+        """Per-adapter snapshot of capacity, load and failure counts."""
+        now = time.monotonic()
+        with self._cond:
+            return {
+                s.name: {
+                    "capacity": s.capacity,
+                    "active": s.active,
+                    "utilization": s.load(),
+                    "connections": s.connections,
+                    "failures": s.failures,
+                    "suspended": s.isSuspended(now),
+                }
+                for s in self._slots.values()
+            }
@@ -0,0 +1,366 @@
+"""Simulated Blufi link and device, for testing and benchmarking without
+hardware.
+
+SimulatedLink stands in for the BleakClient a BlufiClient writes to. Every
+frame written goes through configurable impairment (latency, jitter, loss,
+duplication, reordering, MTU limits) to a SimulatedDevice. The device speaks
+the device side of the protocol and answers the same way, through the same
+impairment, as notifications. Runs are reproducible from `seed`.
+
+    link = SimulatedLink(SimulatedDevice(networks={'lab': 'secret123'}),
+                         LinkImpairment(latency=0.01, jitter=0.005, loss=0.01, seed=1))
+    client.connectTransport(link)
+"""
+from typing import Callable, Dict, Optional
+
+import asyncio
+import hashlib
+import random
+import struct
+
+from blufi.constants import *
+from blufi.framectrl import FrameCtrlData, getPackageType, getSubType, getTypeValue
+from blufi.security import BlufiAES, BlufiCRC
+from blufi.utils import generateAESIV
+
+import logging
+log = logging.getLogger("blufi")
+
+# Device side error codes, as reported in DATA.SUBTYPE_ERROR
+SIM_SEQUENCE_ERROR = 0
+SIM_CHECKSUM_ERROR = 1
+SIM_DATA_FORMAT_ERROR = 9
+
+class LinkImpairment:
+    """Impairment applied to each frame, in each direction.
+
+    latency/jitter: one-way delay in seconds, uniform in latency +/- jitter.
+    loss, duplicate, reorder: per-frame probabilities. A reordered frame is
+    held back and delivered after the next one, or after one more link delay
+    if no other frame follows.
+    mtu: ATT MTU. Longer writes are cut to mtu - 3 bytes when `truncate` is
+    set, otherwise the write fails like a real stack would reject it.
+    """
+    def __init__(self, latency: float = 0.0, jitter: float = 0.0, loss: float = 0.0,
+                 duplicate: float = 0.0, reorder: float = 0.0, mtu: int = 517,
+                 truncate: bool = True, seed: Optional[int] = None):
+        self.latency = latency
+        self.jitter = jitter
+        self.loss = loss
+        self.duplicate = duplicate
+        self.reorder = reorder
+        self.mtu = mtu
+        self.truncate = truncate
+        self.seed = seed
+
+class SimulatedDevice:
+    """Device side of the Blufi protocol, enough to provision against.
+
+    Knows the Wi-Fi networks in `networks` (SSID -> password). Connecting to
+    one reports STA_CONN_SUCCESS after `connectDelay` seconds; an unknown SSID
+    or wrong password reports STA_CONN_FAIL with the matching WIFI_REASON_*.
+    Custom data is echoed back when `echo` is set.
+    """
+    def __init__(self, networks: Optional[Dict[str, str]] = None, connectDelay: float = 0.2,
+                 version=(1, 3), echo: bool = True, seed: Optional[int] = None):
+        self.networks = networks or {}
+        self.connectDelay = connectDelay
+        self.version = version
+        self.echo = echo
+        self._rng = random.Random(seed)
+        # Set by SimulatedLink: notification sink and ATT payload size
+        self.send = None
+        self.maxPayload = 512
+        self.reset()
+
+    def reset(self) -> None:
+        """Session state, as after a new BLE connection."""
+        self.recvSeq = 0
+        self.sendSeq = 0
+        self.secMode = 0
+        self.aesKey = None
+        self.rxBuf = bytearray()
+        self.negLength = 0
+        self.opMode = OP_MODE_NULL
+        self.staSsid = None
+        self.staPassword = None
+        self.staConn = STA_CONN_FAIL
+        self.reason = -1
+        self.config = {}
+        self.errors = []
+        self.received = []
+
+    # -- receive path
+
+    def onWrite(self, frame: bytes) -> None:
+        if len(frame) < PACKAGE_HEADER_LENGTH:
+            return self._error(SIM_DATA_FORMAT_ERROR)
+        type, frameCtrl, seq, dataLen = frame[0], frame[1], frame[2], frame[3]
+        if seq != self.recvSeq:
+            log.debug("sim: seq %d, expected %d" % (seq, self.recvSeq))
+            return self._error(SIM_SEQUENCE_ERROR)
+        self.recvSeq = (self.recvSeq + 1) & 0xFF
+        fctl = FrameCtrlData(frameCtrl)
+        data = bytes(frame[4:4 + dataLen])
+        if len(data) != dataLen:
+            return self._error(SIM_DATA_FORMAT_ERROR)
+        if fctl.isEncrypted():
+            if self.aesKey is None:
+                return self._error(SIM_DATA_FORMAT_ERROR)
+            data = BlufiAES(self.aesKey, generateAESIV(seq)).decrypt(data)
+        if fctl.isChecksum():
+            crc = BlufiCRC.calcCRC(0, struct.pack("<BB", seq, dataLen))
+            crc = BlufiCRC.calcCRC(crc, data)
+            if frame[4 + dataLen:6 + dataLen] != struct.pack("<H", crc):
+                return self._error(SIM_CHECKSUM_ERROR)
+        if fctl.isAckRequirement():
+            self._sendCtrl(CTRL.SUBTYPE_ACK, bytes([seq]))
+        if fctl.hasFrag():
+            self.rxBuf.extend(data[2:])
+            return
+        self.rxBuf.extend(data)
+        payload, self.rxBuf = bytes(self.rxBuf), bytearray()
+        self.received.append((type, payload))
+        if getPackageType(type) == CTRL.PACKAGE_VALUE:
+            self._onCtrl(getSubType(type), payload)
+        else:
+            self._onData(getSubType(type), payload)
+
+    def _onCtrl(self, subType: int, data: bytes) -> None:
+        if subType == CTRL.SUBTYPE_SET_SEC_MODE and data:
+            self.secMode = data[0]
+        elif subType == CTRL.SUBTYPE_SET_OP_MODE and data:
+            self.opMode = data[0]
+        elif subType == CTRL.SUBTYPE_CONNECT_WIFI:
+            self._connectWifi()
+        elif subType == CTRL.SUBTYPE_GET_WIFI_STATUS:
+            self._sendWifiState()
+        elif subType == CTRL.SUBTYPE_GET_VERSION:
+            self._sendData(DATA.SUBTYPE_VERSION, bytes(self.version))
+        elif subType == CTRL.SUBTYPE_GET_WIFI_LIST:
+            entries = bytearray()
+            for ssid in self.networks:
+                ssidBytes = ssid.encode('utf-8')
+                entries += bytes([len(ssidBytes) + 1]) + struct.pack('<b', self._rng.randint(-90, -40)) + ssidBytes
+            self._sendData(DATA.SUBTYPE_WIFI_LIST, bytes(entries))
+
+    def _onData(self, subType: int, data: bytes) -> None:
+        if subType == DATA.SUBTYPE_NEG:
+            self._negotiate(data)
+        elif subType == DATA.SUBTYPE_STA_WIFI_SSID:
+            self.staSsid = data.decode('utf-8', errors='replace')
+        elif subType == DATA.SUBTYPE_STA_WIFI_PASSWORD:
+            self.staPassword = data.decode('utf-8', errors='replace')
+        elif subType == DATA.SUBTYPE_CUSTOM_DATA:
+            if self.echo:
+                self._sendData(DATA.SUBTYPE_CUSTOM_DATA, data)
+        else:
+            self.config[subType] = data
+
+    def _negotiate(self, data: bytes) -> None:
+        if not data:
+            return self._error(SIM_DATA_FORMAT_ERROR)
+        if data[0] == NEG_SECURITY_SET_TOTAL_LENGTH:
+            self.negLength = (data[1] << 8) | data[2]
+            return
+        if data[0] != NEG_SECURITY_SET_ALL_DATA:
+            return self._error(SIM_DATA_FORMAT_ERROR)
+        fields = []
+        offset = 1
+        for _ in range(3):
+            length = (data[offset] << 8) | data[offset + 1]
+            fields.append(int.from_bytes(data[offset + 2:offset + 2 + length], 'big'))
+            offset += 2 + length
+        p, g, clientY = fields
+        priv = self._rng.getrandbits(256) | 1
+        pLength = (p.bit_length() + 7) // 8
+        shared = pow(clientY, priv, p).to_bytes(pLength, 'big')
+        self.aesKey = hashlib.md5(shared).digest()
+        self._sendData(DATA.SUBTYPE_NEG, pow(g, priv, p).to_bytes(pLength, 'big'))
+
+    def _connectWifi(self) -> None:
+        self.staConn = STA_CONN_CONNECTING
+        password = self.networks.get(self.staSsid)
+        if password is None:
+            staConn, reason = STA_CONN_FAIL, WIFI_REASON_NO_AP_FOUND
+        elif password != (self.staPassword or ""):
+            staConn, reason = STA_CONN_FAIL, WIFI_REASON_4WAY_HANDSHAKE_TIMEOUT
+        else:
+            staConn, reason = STA_CONN_SUCCESS, -1
+
+        def done():
+            self.staConn = staConn
+            self.reason = reason
+            self._sendWifiState()
+        asyncio.get_running_loop().call_later(self.connectDelay, done)
+
+    def _sendWifiState(self) -> None:
+        state = bytearray([self.opMode, self.staConn, 0])
+        if self.staSsid:
+            ssidBytes = self.staSsid.encode('utf-8')
+            state += bytes([DATA.SUBTYPE_STA_WIFI_SSID, len(ssidBytes)]) + ssidBytes
+        if self.staConn == STA_CONN_FAIL and self.reason >= 0:
+            state += bytes([DATA.SUBTYPE_WIFI_STA_CONN_END_REASON, 1, self.reason])
+        if self.staConn == STA_CONN_SUCCESS:
+            state += bytes([DATA.SUBTYPE_WIFI_STA_CONN_RSSI, 1]) + struct.pack('<b', self._rng.randint(-80, -40))
+        self._sendData(DATA.SUBTYPE_WIFI_CONNECTION_STATE, bytes(state))
+
+    def _error(self, code: int) -> None:
+        self.errors.append(code)
+        self._sendData(DATA.SUBTYPE_ERROR, bytes([code]))
+
+    # -- send path
+
+    def _sendCtrl(self, subType: int, data: bytes) -> None:
+        self._sendPackage(getTypeValue(CTRL.PACKAGE_VALUE, subType), data,
+                          bool(self.secMode & 0b100000), bool(self.secMode & 0b10000))
+
+    def _sendData(self, subType: int, data: bytes) -> None:
+        # The public key goes out before there is a session key.
+        secure = subType != DATA.SUBTYPE_NEG
+        self._sendPackage(getTypeValue(DATA.PACKAGE_VALUE, subType), data,
+                          secure and bool(self.secMode & 0b10), secure and bool(self.secMode & 0b1))
+
+    def _sendPackage(self, type: int, data: bytes, encrypt: bool, checksum: bool) -> None:
+        if self.send is None:
+            return
+        # Notifications are limited by the MTU like writes are
+        limit = min(self.maxPayload, MAX_PACKAGE_LENGTH) - PACKAGE_HEADER_LENGTH - 2 - (2 if checksum else 0)
+        offset = 0
+        while True:
+            chunk = data[offset:offset + limit]
+            frag = offset + len(chunk) < len(data)
+            if frag:
+                chunk = struct.pack("<H", len(data) - offset) + chunk
+            self.send(self._frame(type, chunk, encrypt, checksum, frag))
+            offset += limit
+            if not frag:
+                break
+
+    def _frame(self, type: int, data: bytes, encrypt: bool, checksum: bool, frag: bool) -> bytes:
+        seq = self.sendSeq
+        self.sendSeq = (self.sendSeq + 1) & 0xFF
+        frameCtrl = FrameCtrlData.getFrameCTRLValue(encrypt and self.aesKey is not None, checksum,
+                                                    DIRECTION_INPUT, False, frag)
+        out = bytearray([type, frameCtrl, seq, len(data)])
+        crc = None
+        if checksum:
+            crc = BlufiCRC.calcCRC(BlufiCRC.calcCRC(0, struct.pack("<BB", seq, len(data))), data)
+        if encrypt and self.aesKey is not None and data:
+            data = BlufiAES(self.aesKey, generateAESIV(seq)).encrypt(data)
+        out += data
+        if crc is not None:
+            out += struct.pack("<H", crc)
+        return bytes(out)
+
+class SimulatedLink:
+    """Drop-in for the BleakClient used by BlufiClient, connecting it to a
+    SimulatedDevice through a LinkImpairment. Pass it to
+    BlufiClient.connectTransport().
+
+    `stats` counts what happened to frames in both directions.
+    """
+    def __init__(self, device: SimulatedDevice, impairment: Optional[LinkImpairment] = None,
+                 address: str = "SIM:00:00:00:00:01"):
+        self.device = device
+        self.impairment = impairment or LinkImpairment()
+        self.address = address
+        self.is_connected = True
+        self.mtu_size = self.impairment.mtu
+        self._rng = random.Random(self.impairment.seed)
+        self._notify = None
+        self._held = {"up": None, "down": None}
+        self._disconnectedCallback = None
+        self.stats = dict(written=0, notified=0, dropped=0, duplicated=0, reordered=0, truncated=0)
+        device.maxPayload = self.impairment.mtu - 3
+        device.send = self._deviceSend
+        device.reset()
+
+    def setDisconnectedCallback(self, callback: Optional[Callable]) -> None:
+        self._disconnectedCallback = callback
+
+    def _delay(self) -> float:
+        imp = self.impairment
+        return max(0.0, imp.latency + self._rng.uniform(-imp.jitter, imp.jitter))
+
+    def _deliver(self, direction: str, frame: bytes, handler: Callable[[bytes], None]) -> None:
+        """Apply loss, duplication and reordering, then hand to `handler`."""
+        imp = self.impairment
+        if self._rng.random() < imp.loss:
+            self.stats["dropped"] += 1
+            return
+        frames = [frame]
+        if self._rng.random() < imp.duplicate:
+            self.stats["duplicated"] += 1
+            frames.append(frame)
+        if self._held[direction] is None and self._rng.random() < imp.reorder:
+            self.stats["reordered"] += 1
+            # Don't wait forever for a next frame, the held one may be the
+            # last of a burst.
+            timer = asyncio.get_running_loop().call_later(self._delay(), self._release, direction)
+            self._held[direction] = (frames, handler, timer)
+            return
+        for f in frames:
+            handler(f)
+        self._release(direction)
+
+    def _release(self, direction: str) -> None:
+        held, self._held[direction] = self._held[direction], None
+        if held is not None:
+            frames, handler, timer = held
+            timer.cancel()
+            for f in frames:
+                handler(f)
+
+    async def write_gatt_char(self, char_specifier, data, response: bool = False) -> None:
+        if not self.is_connected:
+            raise Exception("Not connected")
+        data = bytes(data)
+        if len(data) > self.impairment.mtu - 3:
+            if not self.impairment.truncate:
+                raise Exception("Invalid Attribute Value Length")
+            self.stats["truncated"] += 1
+            data = data[:self.impairment.mtu - 3]
+        self.stats["written"] += 1
+        await asyncio.sleep(self._delay())
+        self._deliver("up", data, self.device.onWrite)
+        if response:
+            # Write response travels back over the link too
+            await asyncio.sleep(self._delay())
+
+    def _deviceSend(self, frame: bytes) -> None:
+        loop = asyncio.get_running_loop()
+
+        def notify(f):
+            if self._notify is not None and self.is_connected:
+                self.stats["notified"] += 1
+                self._notify(None, bytearray(f))
+        loop.call_later(self._delay(), self._deliver, "down", frame, notify)
+
+    async def connect(self) -> bool:
+        """Bring a dropped link back up, as a fresh BLE connection."""
+        self.is_connected = True
+        for held in self._held.values():
+            if held is not None:
+                held[2].cancel()
+        self._held = {"up": None, "down": None}
+        self.device.reset()
+        return True
+
+    async def start_notify(self, char_specifier, callback) -> None:
+        self._notify = callback
+
+    async def stop_notify(self, char_specifier) -> None:
+        self._notify = None
+
+    async def disconnect(self) -> bool:
+        self.is_connected = False
+        self._notify = None
+        return True
+
+    def dropLink(self) -> None:
+        """Simulate the peer going away: fail writes from now on and tell the
+        client, like bleak's disconnected_callback would."""
+        self.is_connected = False
+        if self._disconnectedCallback is not None:
+            self._disconnectedCallback(self)
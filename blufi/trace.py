@@ -0,0 +1,115 @@
+from typing import Optional
+
+import asyncio
+import collections
+import contextlib
+import itertools
+import json
+import os
+import threading
+import time
+import weakref
+
+# Shared no-op context for when tracing is off. nullcontext is reusable.
+NULL_SPAN = contextlib.nullcontext()
+# Names remembered for tracks (tasks, threads), oldest dropped first.
+MAX_TRACK_NAMES = 4096
+
+# Track numbers are handed out once and never reused, unlike the id() of a
+# collected task or the ident of a finished thread.
+_trackNumbers = itertools.count(1)
+_taskTracks = weakref.WeakKeyDictionary()
+_threadTracks = threading.local()
+_trackLock = threading.Lock()
+
+def _track() -> int:
+    """Track id for the current span: the asyncio task when in one, so spans
+    of interleaved tasks on the bleak loop stay properly nested, else the
+    thread."""
+    try:
+        task = asyncio.current_task()
+    except RuntimeError:
+        task = None
+    if task is None:
+        track = getattr(_threadTracks, "track", None)
+        if track is None:
+            with _trackLock:
+                track = _threadTracks.track = next(_trackNumbers)
+        return track
+    with _trackLock:
+        track = _taskTracks.get(task)
+        if track is None:
+            track = _taskTracks[task] = next(_trackNumbers)
+    return track
+
+def _trackName() -> str:
+    try:
+        task = asyncio.current_task()
+    except RuntimeError:
+        task = None
+    if task is not None:
+        return "%s (%s)" % (task.get_name(), threading.current_thread().name)
+    return threading.current_thread().name
+
+class Tracer:
+    """Records nested, monotonic-timestamped spans into a ring buffer and
+    exports them as Chrome trace-event JSON, viewable in Perfetto or
+    chrome://tracing.
+
+    Attach to a client with BlufiClient.setTracer(). Only the most recent
+    `capacity` events are kept.
+    """
+    def __init__(self, capacity: int = 65536):
+        self._events = collections.deque(maxlen=capacity)
+        self._tracks = collections.OrderedDict()
+        # Spans come from both the caller and the bleak thread
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+
+    def _record(self, name: str, start: int, end: int, args: dict) -> None:
+        track = _track()
+        with self._lock:
+            if track not in self._tracks:
+                self._tracks[track] = _trackName()
+                if len(self._tracks) > MAX_TRACK_NAMES:
+                    self._tracks.popitem(last=False)
+            self._events.append((name, start, end, track, args))
+
+    @contextlib.contextmanager
+    def span(self, name: str, **args):
+        start = time.perf_counter_ns()
+        try:
+            yield
+        finally:
+            self._record(name, start, time.perf_counter_ns(), args)
+
+    def complete(self, name: str, start: int, end: Optional[int] = None, **args) -> None:
+        """Record a span whose start (perf_counter_ns) was taken elsewhere,
+        e.g. in another thread."""
+        self._record(name, start, time.perf_counter_ns() if end is None else end, args)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._events.clear()
+            self._tracks.clear()
+
+    def events(self) -> list:
+        out = []
+        with self._lock:
+            events = list(self._events)
+            tracks = list(self._tracks.items())
+        used = set(e[3] for e in events)
+        for track, trackName in tracks:
+            if track not in used:
+                continue
+            out.append({"name": "thread_name", "ph": "M", "pid": self._pid, "tid": track,
+                        "args": {"name": trackName}})
+        for name, start, end, track, args in events:
+            out.append({"name": name, "ph": "X", "pid": self._pid, "tid": track,
+                        "ts": start / 1000, "dur": (end - start) / 1000, "args": args})
+        return out
+
+    def dump(self, path: str) -> None:
+        """Write the buffered events to `path` as Chrome trace JSON."""
+        with open(path, "w") as f:
+            json.dump({"traceEvents": self.events(), "displayTimeUnit": "ms"}, f)
@@ -0,0 +1,108 @@
+from typing import List, Optional
+
+from blufi.constants import *
+from blufi.framectrl import getTypeValue
+from blufi.utils import bssidToBytes
+
+class BlufiCommand:
+    """One Blufi frame (or fragmented payload) to post.
+
+    encrypt/checksum of None leave the choice to the client's
+    SecurityPolicy, so a command can be built before security has been
+    negotiated.
+    """
+    def __init__(self, type: int, data: Optional[bytes] = None,
+                 encrypt: Optional[bool] = None, checksum: Optional[bool] = None,
+                 requireAck: Optional[bool] = None):
+        self.type = type
+        self.data = bytes(data) if data else None
+        self.encrypt = encrypt
+        self.checksum = checksum
+        self.requireAck = requireAck
+
+    def __repr__(self):
+        return "BlufiCommand(type=0x%02X, len=%d)" % (self.type, len(self.data) if self.data else 0)
+
+class BlufiTransaction:
+    """A multi-step command sequence that is encoded up front and written back
+    to back inside the bleak event loop, instead of one await_bleak round trip
+    per command. See BlufiClient.postTransaction.
+    """
+    def __init__(self, commands: Optional[List[BlufiCommand]] = None):
+        self.commands = list(commands) if commands else []
+
+    def __len__(self):
+        return len(self.commands)
+
+    def add(self, type: int, data: Optional[bytes] = None, **kwargs) -> 'BlufiTransaction':
+        self.commands.append(BlufiCommand(type, data, **kwargs))
+        return self
+
+    def setOpMode(self, opMode: int) -> 'BlufiTransaction':
+        type = getTypeValue(CTRL.PACKAGE_VALUE, CTRL.SUBTYPE_SET_OP_MODE)
+        return self.add(type, (opMode).to_bytes(1, byteorder='little'), requireAck=True)
+
+    def setStaSsid(self, ssid: str) -> 'BlufiTransaction':
+        type = getTypeValue(DATA.PACKAGE_VALUE, DATA.SUBTYPE_STA_WIFI_SSID)
+        return self.add(type, ssid.encode('utf-8'))
+
+    def setStaPassword(self, password: str) -> 'BlufiTransaction':
+        type = getTypeValue(DATA.PACKAGE_VALUE, DATA.SUBTYPE_STA_WIFI_PASSWORD)
+        return self.add(type, password.encode('utf-8'))
+
+    def setStaBssid(self, bssid) -> 'BlufiTransaction':
+        type = getTypeValue(DATA.PACKAGE_VALUE, DATA.SUBTYPE_STA_WIFI_BSSID)
+        return self.add(type, bssidToBytes(bssid))
+
+    def setStaMaxConnRetry(self, retries: int) -> 'BlufiTransaction':
+        type = getTypeValue(DATA.PACKAGE_VALUE, DATA.SUBTYPE_WIFI_STA_MAX_CONN_RETRY)
+        return self.add(type, bytes([retries]))
+
+    def setUsername(self, username: str) -> 'BlufiTransaction':
+        type = getTypeValue(DATA.PACKAGE_VALUE, DATA.SUBTYPE_USERNAME)
+        return self.add(type, username.encode('utf-8'))
+
+    def setCaCert(self, cert: bytes) -> 'BlufiTransaction':
+        type = getTypeValue(DATA.PACKAGE_VALUE, DATA.SUBTYPE_CA_CERTIFICATION)
+        return self.add(type, cert)
+
+    def setClientCert(self, cert: bytes) -> 'BlufiTransaction':
+        type = getTypeValue(DATA.PACKAGE_VALUE, DATA.SUBTYPE_CLIENT_CERTIFICATION)
+        return self.add(type, cert)
+
+    def setClientKey(self, key: bytes) -> 'BlufiTransaction':
+        type = getTypeValue(DATA.PACKAGE_VALUE, DATA.SUBTYPE_CLIENT_PRIVATE_KEY)
+        return self.add(type, key)
+
+    def setSoftapSsid(self, ssid: str) -> 'BlufiTransaction':
+        type = getTypeValue(DATA.PACKAGE_VALUE, DATA.SUBTYPE_SOFTAP_WIFI_SSID)
+        return self.add(type, ssid.encode('utf-8'))
+
+    def setSoftapPassword(self, password: str) -> 'BlufiTransaction':
+        type = getTypeValue(DATA.PACKAGE_VALUE, DATA.SUBTYPE_SOFTAP_WIFI_PASSWORD)
+        return self.add(type, password.encode('utf-8'))
+
+    def setSoftapMaxConnection(self, count: int) -> 'BlufiTransaction':
+        type = getTypeValue(DATA.PACKAGE_VALUE, DATA.SUBTYPE_SOFTAP_MAX_CONNECTION_COUNT)
+        return self.add(type, bytes([count]))
+
+    def setSoftapAuthMode(self, authMode: int) -> 'BlufiTransaction':
+        type = getTypeValue(DATA.PACKAGE_VALUE, DATA.SUBTYPE_SOFTAP_AUTH_MODE)
+        return self.add(type, bytes([authMode]))
+
+    def setSoftapChannel(self, channel: int) -> 'BlufiTransaction':
+        type = getTypeValue(DATA.PACKAGE_VALUE, DATA.SUBTYPE_SOFTAP_CHANNEL)
+        return self.add(type, bytes([channel]))
+
+    def ackLastOnly(self) -> 'BlufiTransaction':
+        """Ask for an ack on the last command only. Frames are handled in
+        order, so that one ack covers the whole burst."""
+        for cmd in self.commands:
+            cmd.requireAck = False
+        if self.commands:
+            self.commands[-1].requireAck = True
+        return self
+
+    def connectWifi(self) -> 'BlufiTransaction':
+        type = getTypeValue(CTRL.PACKAGE_VALUE, CTRL.SUBTYPE_CONNECT_WIFI)
+        return self.add(type, None)
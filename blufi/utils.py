@@ -1,7 +1,13 @@
+from typing import Optional
+
 import asyncio
 import contextlib
 import os
 import platform
+import threading
+import time
+
+from blufi.exceptions import TimeoutError
 
 # Special Event class to use Events with an event loop in another thread
 # https://stackoverflow.com/questions/33000200/asyncio-wait-for-event-from-other-thread
@@ -13,11 +19,97 @@ class Event_ts(asyncio.Event):
         if self._loop is None:
             self._loop = asyncio.get_event_loop()
 
+    def _in_loop(self) -> bool:
+        try:
+            return asyncio.get_running_loop() is self._loop
+        except RuntimeError:
+            return False
+
     def set(self):
-        self._loop.call_soon_threadsafe(super().set)
+        if self._in_loop():
+            super().set()
+        else:
+            self._loop.call_soon_threadsafe(super().set)
 
     def clear(self):
-        self._loop.call_soon_threadsafe(super().clear)
+        if self._in_loop():
+            super().clear()
+        else:
+            self._loop.call_soon_threadsafe(super().clear)
+
+class LoopThread:
+    """An asyncio event loop running in a daemon thread, for bleak.
+
+    Every BlufiClient starts its own unless given one. Several clients can
+    share one instead, which saves a thread per client. A shared loop belongs
+    to whoever created it, call stop() when all its clients are closed.
+    """
+    def __init__(self, name: str = "blufi-loop"):
+        self.loop = None
+        self._ready = threading.Event()
+        self._thread = threading.Thread(target=self._run, name=name)
+        # Discard thread quietly on exit.
+        self._thread.daemon = True
+        self._thread.start()
+        # Wait for thread to start.
+        self._ready.wait()
+
+    def _run(self) -> None:
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        # Event loop is now available.
+        self._ready.set()
+        try:
+            self.loop.run_forever()
+        finally:
+            # Let whatever is left unwind before closing the loop.
+            tasks = asyncio.all_tasks(self.loop)
+            for task in tasks:
+                task.cancel()
+            if tasks:
+                self.loop.run_until_complete(asyncio.gather(*tasks, return_exceptions=True))
+            self.loop.run_until_complete(self.loop.shutdown_asyncgens())
+            self.loop.run_until_complete(self.loop.shutdown_default_executor())
+            self.loop.close()
+
+    def is_alive(self) -> bool:
+        return self._thread.is_alive()
+
+    def stop(self, timeout: Optional[float] = 5.0) -> None:
+        """Stop the loop and wait for the thread to finish. Called from the
+        loop thread itself it only stops the loop."""
+        if not self._thread.is_alive():
+            return
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        if threading.current_thread() is not self._thread:
+            self._thread.join(timeout)
+
+class Deadline:
+    """One overall time budget for an operation, handed down to its
+    sub-steps. A timeout of None means no deadline."""
+    def __init__(self, timeout: Optional[float]):
+        self.timeout = timeout
+        self.expires = None if timeout is None else time.monotonic() + timeout
+
+    def remaining(self) -> Optional[float]:
+        if self.expires is None:
+            return None
+        return max(self.expires - time.monotonic(), 0.0)
+
+    def expired(self) -> bool:
+        return self.expires is not None and time.monotonic() >= self.expires
+
+    def check(self, what: str = "operation") -> None:
+        if self.expired():
+            raise TimeoutError("%s: deadline of %.1fs exceeded" % (what, self.timeout))
+
+    def budget(self, share: float = 1.0, cap: Optional[float] = None) -> Optional[float]:
+        """Time to give one sub-step: `share` of what is left, at most `cap`."""
+        remaining = self.remaining()
+        if remaining is None:
+            return cap
+        remaining *= share
+        return remaining if cap is None else min(remaining, cap)
 
 def generateAESIV(seq):
     iv = bytearray(16)
@@ -47,3 +139,11 @@ def get_platform_type() -> str:
         return 'Windows'
 
     raise Exception(f"Unsupported platform: {platform.system()}")
+
+def bssidToBytes(bssid) -> bytes:
+    """Accepts 'aa:bb:cc:dd:ee:ff' (or '-' separated) or 6 raw bytes."""
+    if isinstance(bssid, str):
+        bssid = bytes.fromhex(bssid.replace(':', '').replace('-', ''))
+    if len(bssid) != 6:
+        raise ValueError("BSSID must be 6 bytes")
+    return bytes(bssid)
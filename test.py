@@ -60,6 +60,7 @@ if TEST_SCAN:
 if TEST_POST_WIFI:
     client.postDeviceMode(blufi.OP_MODE_STA)
     client.postStaWifiInfo(TEST_POST_WIFI_CREDS)
+    print('STA connection: ', client.waitForStaConnection(timeout=15))
 
 if TEST_CUSTOM_DATA:
     client.postCustomData(data=bytes.fromhex('010203'))
@@ -0,0 +1,15 @@
+import pytest
+
+import blufi
+from blufi.sim import LinkImpairment, SimulatedDevice, SimulatedLink
+
+@pytest.fixture
+def sim():
+    """A connected client on a simulated link. Yields (client, link, device)."""
+    device = SimulatedDevice(networks={'lab': 'secret123'}, connectDelay=0.05, echo=False, seed=1)
+    link = SimulatedLink(device, LinkImpairment(latency=0.002, seed=1))
+    client = blufi.BlufiClient()
+    client.setPostPackageLengthLimit(64)
+    assert client.connectTransport(link)
+    yield client, link, device
+    client.close()
@@ -0,0 +1,36 @@
+import asyncio
+import inspect
+
+import pytest
+
+import blufi
+import blufi.exceptions
+from blufi.constants import DATA
+from blufi.framectrl import getTypeValue
+
+def test_inner_timeout_is_not_a_deadline():
+    async def inner():
+        await asyncio.wait_for(asyncio.sleep(1), 0.01)
+
+    with blufi.BlufiClient() as client:
+        for timeout in (None, 5):
+            with pytest.raises(TimeoutError) as info:
+                client.await_bleak(inner(), timeout)
+            assert not isinstance(info.value, blufi.BluetoothError)
+        with pytest.raises(blufi.BluetoothError):
+            client.await_bleak(asyncio.sleep(1), 0.05)
+
+def test_deadline_cancels_post(sim):
+    client, link, device = sim
+    # About 40 fragments, 50 ms apart
+    with pytest.raises(blufi.exceptions.TimeoutError):
+        client.postCustomData(bytes(2048), timeout=0.5)
+
+def test_bulk_post_has_no_default_deadline(sim):
+    client, link, device = sim
+    for post in (client.postCustomData, client.postProfile, client.postTransaction):
+        assert inspect.signature(post).parameters['timeout'].default is None
+    blob = bytes(range(256)) * 8
+    assert client.postCustomData(blob)
+    customType = getTypeValue(DATA.PACKAGE_VALUE, DATA.SUBTYPE_CUSTOM_DATA)
+    assert [p for t, p in device.received if t == customType] == [blob]
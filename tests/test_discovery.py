@@ -0,0 +1,63 @@
+import asyncio
+
+import blufi.discovery
+
+class Device:
+    def __init__(self, address, name=None):
+        self.address = address
+        self.name = name
+
+class Adv:
+    def __init__(self, rssi):
+        self.rssi = rssi
+
+def fakeScanner(adverts):
+    class FakeScanner:
+        def __init__(self, detection_callback, service_uuids, **kwargs):
+            self.callback = detection_callback
+
+        async def start(self):
+            self.task = asyncio.ensure_future(self.play())
+
+        async def play(self):
+            for device, adv in adverts:
+                self.callback(device, adv)
+                await asyncio.sleep(0.01)
+
+        async def stop(self):
+            self.task.cancel()
+    return FakeScanner
+
+def test_filters_are_rechecked(monkeypatch):
+    adverts = [
+        (Device('AA:01'), Adv(-80)),            # too weak, no name yet
+        (Device('AA:02', 'BLUFI_2'), Adv(-50)),  # denied by address
+        (Device('AA:01', 'BLUFI_1'), Adv(-50)),
+        (Device('AA:02', 'BLUFI_2'), Adv(-40)),
+    ]
+    monkeypatch.setattr(blufi.discovery, "BleakScanner", fakeScanner(adverts))
+
+    async def handler(device):
+        return device.name
+
+    pipeline = blufi.DiscoveryPipeline(handler, workers=1, minRssi=-70,
+                                       allow=['BLUFI_1', 'BLUFI_2'], deny=['AA:02'])
+    assert pipeline.run(duration=0.3) == {'AA:01': 'BLUFI_1'}
+
+def test_queue_ranked_by_rssi(monkeypatch):
+    adverts = [(Device('AA:%02d' % n), Adv(-90 + n)) for n in range(5)]
+    monkeypatch.setattr(blufi.discovery, "BleakScanner", fakeScanner(adverts))
+    order = []
+
+    async def handler(device):
+        order.append(device.address)
+        await asyncio.sleep(0.1)
+        return True
+
+    pipeline = blufi.DiscoveryPipeline(handler, workers=1, maxQueued=2)
+    results = pipeline.run(duration=0.3)
+    assert order[0] == 'AA:00'
+    # Strongest of what was waiting goes next; the queue never held more than 2
+    assert order[1:] == ['AA:04', 'AA:03']
+    assert pipeline.stats['evicted'] + pipeline.stats['rejected'] > 0
+    assert all(results.values())
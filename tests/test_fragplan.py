@@ -0,0 +1,73 @@
+import io
+import os
+import struct
+
+import pytest
+
+import blufi
+from blufi.constants import DATA
+from blufi.fragplan import FragmentPlan, FragmentPlanCache
+from blufi.framectrl import getTypeValue
+
+def legacyFragments(data, limit):
+    """The fragments the pre-plan postContainData loop produced."""
+    dataIS = io.BytesIO(data)
+    readLeft = len(data)
+    out = []
+    while True:
+        chunk = dataIS.read(limit)
+        if not chunk:
+            break
+        readLeft -= len(chunk)
+        if 0 < readLeft <= 2:
+            more = dataIS.read(limit)
+            chunk += more
+            readLeft -= len(more)
+        frag = readLeft > 0
+        if frag:
+            chunk = struct.pack("<H", len(chunk) + readLeft) + chunk
+        out.append((chunk, frag))
+    return out
+
+@pytest.mark.parametrize("limit", [2, 12, 14, 249])
+def test_matches_legacy_loop(limit):
+    for size in list(range(1, 4 * limit + 8)) + [1000, 4096]:
+        data = os.urandom(size)
+        plan = FragmentPlan(data, limit)
+        assert [(bytes(chunk), frag) for chunk, frag, _ in plan.fragments] == legacyFragments(data, limit)
+        assert plan.fragments[-1][2] == size
+
+def test_trailing_bytes_join_last_frame():
+    plan = FragmentPlan(bytes(22), 10)
+    assert [len(chunk) for chunk, _, _ in plan.fragments] == [12, 12]
+    assert [frag for _, frag, _ in plan.fragments] == [True, False]
+    plan = FragmentPlan(bytes(23), 10)
+    assert [len(chunk) for chunk, _, _ in plan.fragments] == [12, 12, 3]
+
+def test_cache_is_bounded():
+    cache = FragmentPlanCache(maxEntries=2)
+    payloads = [os.urandom(100) for _ in range(3)]
+    plans = [cache.get(p, 16) for p in payloads]
+    assert cache.get(payloads[2], 16) is plans[2]
+    assert cache.get(payloads[0], 16) is not plans[0]
+    assert cache.stats()["entries"] == 2
+    assert cache.stats()["hits"] == 1
+    small = FragmentPlanCache(maxBytes=50)
+    small.get(payloads[0], 16)
+    assert small.stats()["entries"] == 0
+
+def test_credentials_not_retained(sim):
+    client, link, device = sim
+    cache = FragmentPlanCache()
+    client.setFragmentPlanCache(cache)
+    client.setPostPackageLengthLimit(20)
+    assert client.negotiateSecurity()
+    password = 'a-fairly-long-password'
+    assert client.postStaWifiInfo({'ssid': 'lab', 'pass': password})
+    passwordType = getTypeValue(DATA.PACKAGE_VALUE, DATA.SUBTYPE_STA_WIFI_PASSWORD)
+    assert [p for t, p in device.received if t == passwordType] == [password.encode()]
+    blob = bytes(range(100))
+    assert client.postCustomData(blob)
+    # Only the custom data was cached, not the password nor the DH key
+    assert cache.stats()["entries"] == 1
+    assert all(password.encode() not in plan._buffer for plan in cache._plans.values())
@@ -0,0 +1,90 @@
+import pytest
+
+import blufi
+import blufi.fragsize
+from blufi.constants import MAX_PACKAGE_LENGTH, MIN_PACKAGE_LENGTH
+from blufi.fragsize import FragmentSizer, forgetPackageLengths, learnedPackageLength
+
+@pytest.fixture(autouse=True)
+def forget():
+    forgetPackageLengths()
+    yield
+    forgetPackageLengths()
+
+def test_grows_on_fast_writes():
+    sizer = FragmentSizer(step=16, growAfter=4, targetLatency=0.1)
+    assert sizer.packageLength() == MIN_PACKAGE_LENGTH
+    for _ in range(3):
+        sizer.onWrite(0.01)
+    # A slow write starts the count over
+    sizer.onWrite(0.5)
+    for _ in range(3):
+        sizer.onWrite(0.01)
+    assert sizer.packageLength() == MIN_PACKAGE_LENGTH
+    sizer.onWrite(0.01)
+    assert sizer.packageLength() == MIN_PACKAGE_LENGTH + 16
+
+def test_stays_within_bounds():
+    sizer = FragmentSizer(initial=1000, step=100, growAfter=1)
+    assert sizer.packageLength() == MAX_PACKAGE_LENGTH
+    sizer.onWrite(0.01)
+    assert sizer.packageLength() == MAX_PACKAGE_LENGTH
+    for _ in range(10):
+        sizer.onError("crc")
+    assert sizer.packageLength() == MIN_PACKAGE_LENGTH
+
+def test_shrinks_then_probes_slowly():
+    sizer = FragmentSizer(initial=100, step=20, growAfter=2, backoff=0.5, probeFactor=4)
+    sizer.onError("ack timeout")
+    assert sizer.packageLength() == 50
+    for _ in range(4):
+        sizer.onWrite(0.01)
+    assert sizer.packageLength() == 90
+    # 110 is past the length that failed, it takes growAfter * probeFactor
+    for _ in range(7):
+        sizer.onWrite(0.01)
+    assert sizer.packageLength() == 90
+    sizer.onWrite(0.01)
+    assert sizer.packageLength() == 110
+
+def test_learned_per_address():
+    sizer = FragmentSizer(step=16, growAfter=1)
+    sizer.attach('AA:01')
+    sizer.onWrite(0.01)
+    assert learnedPackageLength('AA:01') == MIN_PACKAGE_LENGTH + 16
+    assert learnedPackageLength('AA:02') is None
+    other = FragmentSizer()
+    other.attach('AA:01')
+    assert other.packageLength() == MIN_PACKAGE_LENGTH + 16
+    other.attach('AA:02')
+    assert other.packageLength() == MIN_PACKAGE_LENGTH
+
+def test_learned_sizes_are_bounded(monkeypatch):
+    monkeypatch.setattr(blufi.fragsize, "MAX_LEARNED_SIZES", 3)
+    sizer = FragmentSizer(growAfter=1)
+    for n in range(5):
+        sizer.attach('AA:%02d' % n)
+        sizer.onWrite(0.01)
+        if n == 2:
+            # Recently used, kept
+            assert learnedPackageLength('AA:00') is not None
+    assert len(blufi.fragsize._learnedSizes) == 3
+    assert learnedPackageLength('AA:01') is None
+    assert learnedPackageLength('AA:00') is not None
+
+def test_capped_by_package_length_limit():
+    with blufi.BlufiClient() as client:
+        client.setFragmentSizer(FragmentSizer(initial=200))
+        assert client._packageLengthLimit() == 200
+        client.setPostPackageLengthLimit(64)
+        assert client._packageLengthLimit() == 60
+
+def test_learns_over_simulated_link(sim):
+    client, link, device = sim
+    client.setPostPackageLengthLimit(0)
+    client.setFragmentSizer(FragmentSizer(step=16, growAfter=2))
+    assert client.negotiateSecurity()
+    blob = bytes(range(256)) * 4
+    assert client.postCustomData(blob)
+    assert learnedPackageLength(link.address) > MIN_PACKAGE_LENGTH
+    assert device.errors == []
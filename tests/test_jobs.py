@@ -0,0 +1,52 @@
+import blufi
+
+class FakeClient:
+    def __init__(self, calls):
+        self.calls = calls
+
+    def connectByName(self, name):
+        return True
+
+    def negotiateSecurity(self):
+        return True
+
+    def postDeviceMode(self, opMode):
+        self.calls.append('mode')
+        return True
+
+    def postStaWifiInfo(self, params):
+        self.calls.append('wifi')
+        return True
+
+    def waitForStaConnection(self, timeout):
+        self.calls.append('verify')
+        return {"success": False, "reason": 201, "reasonName": "WIFI_REASON_NO_AP_FOUND"}
+
+    def close(self):
+        pass
+
+def test_failed_verify_resends_credentials(tmp_path):
+    store = blufi.JobStore(str(tmp_path / 'jobs.db'))
+    store.addJobs(['BLUFI_1'], {'ssid': 'lab', 'pass': 'wrong'})
+    calls = []
+    runner = blufi.ProvisioningRunner(store, clientFactory=lambda job: FakeClient(calls),
+                                      workers=1, maxAttempts=3)
+    assert runner.run() == {'failed': 1}
+    assert calls.count('wifi') == 3 and calls.count('verify') == 3
+    store.close()
+
+def test_crash_on_last_attempt_fails_job(tmp_path):
+    store = blufi.JobStore(str(tmp_path / 'jobs.db'))
+    store.addJobs(['BLUFI_1'], {'ssid': 'lab', 'pass': 'secret123'})
+    # Three runs that each died during their attempt
+    for _ in range(3):
+        assert store.recover() <= 1
+        assert store.claim('crashed', 3) is not None
+    store.close()
+    store = blufi.JobStore(str(tmp_path / 'jobs.db'))
+    calls = []
+    runner = blufi.ProvisioningRunner(store, clientFactory=lambda job: FakeClient(calls),
+                                      workers=1, maxAttempts=3)
+    assert runner.run() == {'failed': 1}
+    assert calls == []
+    store.close()
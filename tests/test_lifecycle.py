@@ -0,0 +1,44 @@
+import asyncio
+import threading
+
+import pytest
+
+import blufi
+from blufi.sim import SimulatedDevice, SimulatedLink
+
+def test_close_releases_thread():
+    before = threading.active_count()
+    for _ in range(20):
+        with blufi.BlufiClient() as client:
+            assert client.connectTransport(SimulatedLink(SimulatedDevice()))
+    assert threading.active_count() == before
+
+def test_shared_loop_survives_client_close():
+    before = threading.active_count()
+    loop = blufi.LoopThread()
+    clients = [blufi.BlufiClient(loop=loop) for _ in range(10)]
+    assert threading.active_count() == before + 1
+    for client in clients:
+        assert client.connectTransport(SimulatedLink(SimulatedDevice()))
+        client.close()
+        client.close()
+    assert loop.is_alive()
+    loop.stop()
+    assert threading.active_count() == before
+
+def test_closed_client_refuses_work():
+    client = blufi.BlufiClient()
+    client.close()
+    with pytest.raises(blufi.BluetoothError):
+        client.requestVersion()
+
+def test_async_context_manager():
+    before = threading.active_count()
+
+    async def main():
+        async with blufi.BlufiClient() as client:
+            loop = asyncio.get_running_loop()
+            assert await loop.run_in_executor(None, client.connectTransport,
+                                              SimulatedLink(SimulatedDevice()))
+    asyncio.run(main())
+    assert threading.active_count() == before
@@ -0,0 +1,62 @@
+import blufi
+from blufi.constants import CTRL, DATA
+from blufi.framectrl import FrameCtrlData, getTypeValue
+from blufi.policy import MSG_BULK, MSG_CREDENTIAL, MSG_CTRL, classify
+
+VERSION_TYPE = getTypeValue(CTRL.PACKAGE_VALUE, CTRL.SUBTYPE_GET_VERSION)
+CHANNEL_TYPE = getTypeValue(DATA.PACKAGE_VALUE, DATA.SUBTYPE_SOFTAP_CHANNEL)
+PASSWORD_TYPE = getTypeValue(DATA.PACKAGE_VALUE, DATA.SUBTYPE_STA_WIFI_PASSWORD)
+CUSTOM_TYPE = getTypeValue(DATA.PACKAGE_VALUE, DATA.SUBTYPE_CUSTOM_DATA)
+
+def test_classify():
+    assert classify(VERSION_TYPE) == MSG_CTRL
+    assert classify(CHANNEL_TYPE) == MSG_CTRL
+    assert classify(PASSWORD_TYPE) == MSG_CREDENTIAL
+    assert classify(CUSTOM_TYPE) == MSG_BULK
+
+def test_defaults():
+    policy = blufi.SecurityPolicy()
+    assert policy.choose(VERSION_TYPE) == (False, True)
+    assert policy.choose(PASSWORD_TYPE) == (True, True)
+    assert policy.choose(CUSTOM_TYPE) == (True, True)
+    assert policy.deviceMode() == (False, True, True, True)
+
+def test_credentials_always_encrypted():
+    policy = blufi.SecurityPolicy(ctrlEncrypt=False, credentialChecksum=False, bulkEncrypt=False)
+    assert policy.choose(PASSWORD_TYPE) == (True, False)
+    assert policy.deviceMode() == (False, True, False, True)
+
+def frameCtrls(link, client):
+    """Record the frame control byte of every frame written by `client`."""
+    sent = []
+    write = link.write_gatt_char
+
+    async def recordingWrite(char, data, response=False):
+        sent.append((data[0], FrameCtrlData(data[1])))
+        await write(char, data, response)
+    link.write_gatt_char = recordingWrite
+    return sent
+
+def test_client_applies_policy(sim):
+    client, link, device = sim
+    client.setSecurityPolicy(blufi.SecurityPolicy(bulkEncrypt=False, bulkChecksum=False))
+    assert client.negotiateSecurity()
+    sent = frameCtrls(link, client)
+    assert client.postCustomData(bytes(300))
+    # Asking for plain text doesn't get a credential out unencrypted
+    client.await_bleak(client.post(False, None, False, PASSWORD_TYPE, b'secret123'))
+    client.requestVersion()
+    client.wait(0.1)
+    bulk = [fc for type, fc in sent if type == CUSTOM_TYPE]
+    assert bulk and not any(fc.isEncrypted() or fc.isChecksum() for fc in bulk)
+    [(_, password)] = [(t, fc) for t, fc in sent if t == PASSWORD_TYPE]
+    assert password.isEncrypted() and password.isChecksum()
+    [(_, version)] = [(t, fc) for t, fc in sent if t == VERSION_TYPE]
+    assert not version.isEncrypted() and version.isChecksum()
+    assert client.getVersion() == "1.3"
+    assert device.errors == []
+
+def test_nothing_secured_before_negotiation():
+    with blufi.BlufiClient() as client:
+        assert client._frameSecurity(PASSWORD_TYPE, None, None) == (False, False)
+        assert client._frameSecurity(CUSTOM_TYPE, None, True) == (False, True)
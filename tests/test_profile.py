@@ -0,0 +1,14 @@
+import pytest
+
+import blufi
+
+def test_changed_profile_is_encoded_again():
+    profile = blufi.DeviceProfile(staSsid='lab', staPassword='secret123')
+    txn = profile.validate()
+    assert profile.validate() is txn
+    profile.staPassword = 'other'
+    assert profile.validate() is not txn
+    assert b'other' in [cmd.data for cmd in profile.validate().commands]
+    profile.staSsid = ''
+    with pytest.raises(ValueError):
+        profile.validate()
@@ -0,0 +1,53 @@
+import threading
+
+import pytest
+
+import blufi
+from blufi.constants import DATA
+from blufi.framectrl import getTypeValue
+
+def received(device, subType):
+    type = getTypeValue(DATA.PACKAGE_VALUE, subType)
+    return [payload for t, payload in device.received if t == type]
+
+def dropLink(client, link):
+    client._bleak_loop.call_soon_threadsafe(link.dropLink)
+
+def test_reconnect_resends_whole_post(sim):
+    client, link, device = sim
+    client.setReconnectPolicy(blufi.ReconnectPolicy(initialDelay=0.05))
+    assert client.negotiateSecurity()
+    blob = bytes(range(256)) * 4
+    timer = threading.Timer(0.3, dropLink, (client, link))
+    timer.start()
+    assert client.postCustomData(blob) is True
+    timer.join()
+    # The device was reset by the reconnect, it holds only what came after
+    assert received(device, DATA.SUBTYPE_CUSTOM_DATA) == [blob]
+    assert client.mAESKey is not None and device.aesKey == client.mAESKey
+
+def test_transaction_resent_after_renegotiating(sim):
+    client, link, device = sim
+    client.setReconnectPolicy(blufi.ReconnectPolicy(initialDelay=0.05))
+    assert client.negotiateSecurity()
+    dropLink(client, link)
+    assert client.postStaWifiInfo({'ssid': 'lab', 'pass': 'pw12345678'})
+    assert received(device, DATA.SUBTYPE_STA_WIFI_PASSWORD) == [b'pw12345678']
+    assert device.errors == []
+
+def test_transaction_not_resent_without_security(sim):
+    client, link, device = sim
+    client.setReconnectPolicy(blufi.ReconnectPolicy(initialDelay=0.05, renegotiate=False))
+    assert client.negotiateSecurity()
+    sent = []
+    write = link.write_gatt_char
+
+    async def recordingWrite(char, data, response=False):
+        sent.append(bytes(data))
+        await write(char, data, response)
+    link.write_gatt_char = recordingWrite
+    dropLink(client, link)
+    with pytest.raises(blufi.ConnectionError):
+        client.postStaWifiInfo({'ssid': 'lab', 'pass': 'pw12345678'})
+    assert not any(b'pw12345678' in frame for frame in sent)
+    assert received(device, DATA.SUBTYPE_STA_WIFI_PASSWORD) == []
@@ -0,0 +1,53 @@
+import threading
+
+import pytest
+
+import blufi
+
+def test_acquire_prefers_least_loaded():
+    sched = blufi.AdapterScheduler({'hci0': 2, 'hci1': 2})
+    first = sched.acquire()
+    second = sched.acquire()
+    assert {first, second} == {'hci0', 'hci1'}
+    sched.release(first)
+    sched.release(second)
+
+def test_acquire_times_out_when_full():
+    sched = blufi.AdapterScheduler({'hci0': 1})
+    sched.acquire()
+    with pytest.raises(blufi.ConnectionError):
+        sched.acquire(timeout=0.05)
+
+def test_failures_suspend_adapter():
+    sched = blufi.AdapterScheduler(['hci0', 'hci1'], failureThreshold=2, cooldown=60)
+    for _ in range(2):
+        with pytest.raises(RuntimeError):
+            with sched.slot(exclude=['hci1']):
+                raise RuntimeError("connect failed")
+    assert sched.utilization()['hci0']['suspended']
+    assert sched.acquire() == 'hci1'
+
+def test_map_respects_capacity_and_retries():
+    sched = blufi.AdapterScheduler({'hci0': 2, 'hci1': 1})
+    lock = threading.Lock()
+    active = {'hci0': 0, 'hci1': 0}
+    peak = {'hci0': 0, 'hci1': 0}
+    tries = {}
+
+    def fn(device, adapter):
+        with lock:
+            active[adapter] += 1
+            peak[adapter] = max(peak[adapter], active[adapter])
+            tries.setdefault(device, []).append(adapter)
+        try:
+            threading.Event().wait(0.01)
+            # dev3 fails on its first adapter only
+            return not (device == 'dev3' and len(tries[device]) == 1)
+        finally:
+            with lock:
+                active[adapter] -= 1
+
+    devices = ['dev%d' % n for n in range(8)]
+    assert sched.map(devices, fn, retries=1) == [True] * 8
+    assert peak['hci0'] <= 2 and peak['hci1'] <= 1
+    assert len(tries['dev3']) == 2 and tries['dev3'][0] != tries['dev3'][1]
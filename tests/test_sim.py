@@ -0,0 +1,47 @@
+import blufi
+from blufi.sim import LinkImpairment, SimulatedDevice, SimulatedLink
+
+def connect(impairment):
+    client = blufi.BlufiClient()
+    link = SimulatedLink(SimulatedDevice(echo=False), impairment)
+    assert client.connectTransport(link)
+    return client, link
+
+def test_negotiate_and_version(sim):
+    client, link, device = sim
+    assert client.negotiateSecurity()
+    assert device.aesKey == client.mAESKey
+    client.requestVersion()
+    client.wait(0.1)
+    assert client.getVersion() == "1.3"
+    assert device.errors == []
+
+def test_held_frame_released_without_followers():
+    # Every frame is held back. With nothing after it, it still has to arrive.
+    client, link = connect(LinkImpairment(latency=0.01, reorder=1.0, seed=1))
+    with client:
+        client.requestVersion()
+        client.wait(0.2)
+        assert client.getVersion() == "1.3"
+        assert link.stats["reordered"] >= 2
+        assert link._held == {"up": None, "down": None}
+
+def test_reordered_frames_arrive_swapped():
+    client, link = connect(LinkImpairment(latency=0.01, seed=1))
+    with client:
+        got = []
+        link.impairment.reorder = 1.0
+
+        async def burst():
+            link._deliver("up", b"1", got.append)
+            link.impairment.reorder = 0.0
+            link._deliver("up", b"2", got.append)
+        client.await_bleak(burst())
+        assert got == [b"2", b"1"]
+
+def test_lossy_link_drops_frames(sim):
+    client, link, device = sim
+    link.impairment.loss = 1.0
+    client.requestVersion()
+    client.wait(0.1)
+    assert link.stats["dropped"] == 1 and device.received == []
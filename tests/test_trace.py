@@ -0,0 +1,84 @@
+import asyncio
+import gc
+import json
+import threading
+
+import blufi
+
+def test_events_and_dump(tmp_path):
+    tracer = blufi.Tracer()
+    with tracer.span("outer", step=1):
+        with tracer.span("inner"):
+            pass
+    events = tracer.events()
+    meta = [e for e in events if e["ph"] == "M"]
+    spans = {e["name"]: e for e in events if e["ph"] == "X"}
+    assert len(meta) == 1 and meta[0]["args"]["name"] == threading.current_thread().name
+    assert spans["outer"]["args"] == {"step": 1}
+    assert spans["outer"]["tid"] == spans["inner"]["tid"] == meta[0]["tid"]
+    assert spans["outer"]["ts"] <= spans["inner"]["ts"]
+    assert spans["inner"]["dur"] <= spans["outer"]["dur"]
+
+    path = tmp_path / "trace.json"
+    tracer.dump(str(path))
+    assert json.loads(path.read_text())["traceEvents"] == events
+    tracer.clear()
+    assert tracer.events() == []
+
+def test_capacity_keeps_latest():
+    tracer = blufi.Tracer(capacity=3)
+    for n in range(5):
+        tracer.complete("span%d" % n, 0, 1)
+    assert [e["name"] for e in tracer.events() if e["ph"] == "X"] == ["span2", "span3", "span4"]
+
+def test_tasks_get_their_own_tracks():
+    tracer = blufi.Tracer()
+
+    async def step(name):
+        with tracer.span(name):
+            await asyncio.sleep(0)
+
+    async def main():
+        for n in range(20):
+            await asyncio.ensure_future(step("task%d" % n))
+            gc.collect()
+    asyncio.run(main())
+    tids = [e["tid"] for e in tracer.events() if e["ph"] == "X"]
+    # Collected tasks often share an id(), their tracks must not
+    assert len(set(tids)) == 20
+
+def test_events_while_recording():
+    tracer = blufi.Tracer(capacity=1000)
+    stop = threading.Event()
+    errors = []
+
+    def record():
+        while not stop.is_set():
+            # A new thread and task per span keeps adding tracks
+            asyncio.run(asyncio.sleep(0))
+            tracer.complete("x", 0, 1)
+            t = threading.Thread(target=tracer.complete, args=("y", 0, 1))
+            t.start()
+            t.join()
+
+    def read():
+        try:
+            for _ in range(200):
+                tracer.events()
+        except Exception as e:
+            errors.append(e)
+
+    writer = threading.Thread(target=record)
+    writer.start()
+    read()
+    stop.set()
+    writer.join()
+    assert errors == []
+
+def test_client_trace(sim):
+    client, link, device = sim
+    tracer = blufi.Tracer()
+    client.setTracer(tracer)
+    assert client.postCustomData(bytes(300))
+    names = [e["name"] for e in tracer.events() if e["ph"] == "X"]
+    assert "write_gatt_char" in names and "thread hop" in names
@@ -0,0 +1,37 @@
+import blufi
+from blufi.constants import DATA
+from blufi.framectrl import getTypeValue
+
+CUSTOM_TYPE = getTypeValue(DATA.PACKAGE_VALUE, DATA.SUBTYPE_CUSTOM_DATA)
+
+def received(device, subType):
+    type = getTypeValue(DATA.PACKAGE_VALUE, subType)
+    return [payload for t, payload in device.received if t == type]
+
+def test_transaction_sends_every_command(sim):
+    client, link, device = sim
+    assert client.negotiateSecurity()
+    txn = blufi.BlufiTransaction()
+    txn.setStaSsid('lab')
+    txn.setStaPassword('secret123')
+    assert client.postTransaction(txn)
+    assert received(device, DATA.SUBTYPE_STA_WIFI_SSID) == [b'lab']
+    assert received(device, DATA.SUBTYPE_STA_WIFI_PASSWORD) == [b'secret123']
+    assert device.errors == []
+
+def test_acked_fragmented_post(sim):
+    client, link, device = sim
+    client.mRequireAck = True
+    assert client.negotiateSecurity()
+    blob = bytes(range(256)) * 2
+    assert client.postCustomData(blob) is True
+    assert received(device, DATA.SUBTYPE_CUSTOM_DATA) == [blob]
+    assert device.errors == []
+
+def test_missing_ack_fails_post(sim, monkeypatch):
+    client, link, device = sim
+    client.mRequireAck = True
+    monkeypatch.setattr(blufi.client, "ACK_TIMEOUT", 0.2)
+    # Device goes deaf: nothing reaches it, nothing gets acked
+    monkeypatch.setattr(device, "onWrite", lambda frame: None)
+    assert client.postCustomData(bytes(200)) is False
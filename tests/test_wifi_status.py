@@ -0,0 +1,20 @@
+import blufi
+
+def test_station_connect_result(sim):
+    client, link, device = sim
+    assert client.negotiateSecurity()
+    client.postStaWifiInfo({'ssid': 'lab', 'pass': 'secret123'})
+    result = client.waitForStaConnection(2)
+    assert result['success'] and result['rssi'] is not None
+    client.postStaWifiInfo({'ssid': 'lab', 'pass': 'wrong'})
+    result = client.waitForStaConnection(2)
+    assert not result['success']
+    assert result['reason'] == blufi.WIFI_REASON_4WAY_HANDSHAKE_TIMEOUT
+    # Not the RSSI of the previous, successful attempt
+    assert result['rssi'] is None
+
+def test_wait_without_timeout(sim):
+    client, link, device = sim
+    assert client.negotiateSecurity()
+    client.postStaWifiInfo({'ssid': 'lab', 'pass': 'secret123'})
+    assert client.waitForStaConnection(None)['success']